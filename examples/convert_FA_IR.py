@@ -2,6 +2,20 @@ import numpy as np
 import pandas as pd
 import random as random
 import pickle
+import os
+import json
+import hashlib
+import tempfile
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+#rankings of a FA*IR experiment: key and file name suffix
+FA_IR_FILES = [('cb', 'ColorblindRanking.pickle'),
+               ('feld', 'FeldmanRanking.pickle')] + \
+              [('fair%d' % i, 'FairRanking%02dPercentProtected.pickle' % i) for i in range(1, 10)]
+
+#name of the cache directory created next to the pickles
+CACHE_DIR = '.fa_ir_cache'
 
 def formatRank_german(df):
     tmp = pd.DataFrame()
@@ -9,51 +23,143 @@ def formatRank_german(df):
     tmp['y_pred']=tmp.index
     tmp['g']=df.sort_values('y_pred',ascending=False).reset_index()['g']
     return tmp
-    
+
 def formatRank_compas(df):
     tmp = pd.DataFrame()
     tmp['y']=df.sort_values('y_pred').index
     tmp['y_pred']=tmp.index
     tmp['g']=df.sort_values('y_pred')['g']
     return tmp
-    
+
+def _fileHash(path):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _compactColumn(values):
+    #store groups as uint8 and ranks as int32 when they fit
+    if values.dtype == bool:
+        return values.astype(np.uint8)
+    if values.dtype.kind in 'iu' and len(values) and \
+            np.iinfo(np.int32).min <= values.min() and values.max() <= np.iinfo(np.int32).max:
+        return values.astype(np.int32)
+    return values
+
+def _writeCache(df, cache, meta):
+    #write into a fresh directory and move it in place so readers never see partial files
+    parent = os.path.dirname(cache)
+    tmp = tempfile.mkdtemp(dir=parent, prefix='.tmp')
+    try:
+        columns = []
+        for i, col in enumerate(df.columns):
+            values = np.asarray(df[col])
+            np.save(os.path.join(tmp, '%d.npy' % i), _compactColumn(values))
+            columns.append([col, values.dtype.str if values.dtype != bool else 'bool'])
+        meta['columns'] = columns
+        if not isinstance(df.index, pd.RangeIndex) or not df.index.equals(pd.RangeIndex(len(df))):
+            np.save(os.path.join(tmp, 'index.npy'), np.asarray(df.index))
+        _writeMeta(tmp, meta)
+        old = cache + '.old%d' % os.getpid()
+        if os.path.exists(cache):
+            os.replace(cache, old)
+        os.replace(tmp, cache)
+        shutil.rmtree(old, ignore_errors=True)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return meta
+
+def _writeMeta(cache, meta):
+    fd, tmp = tempfile.mkstemp(dir=cache, prefix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, os.path.join(cache, 'meta.json'))
+
+def _readCache(cache, meta):
+    data = {}
+    for i, (col, dtype) in enumerate(meta['columns']):
+        #plain array views of the read-only memory map
+        values = np.asarray(np.load(os.path.join(cache, '%d.npy' % i), mmap_mode='r'))
+        data[col] = values.view(bool) if dtype == 'bool' else values
+    index = None
+    if os.path.exists(os.path.join(cache, 'index.npy')):
+        index = np.asarray(np.load(os.path.join(cache, 'index.npy'), mmap_mode='r'))
+    return pd.DataFrame(data, index=index, copy=False)
+
+def cachedFA_IRData(path, funct=None, cache_dir=None):
+    """Read a ranking pickle, formatted by funct, through a columnar cache.
+
+    The first read converts the ranking into one .npy file per column in
+    cache_dir (default: a .fa_ir_cache directory next to the pickle), later
+    reads memory-map them. The cache is rebuilt when the pickle's contents
+    change: its size and mtime are checked first, and a changed mtime only
+    rebuilds if the content hash differs too. Integer columns are stored as
+    int32 and boolean groups as uint8, and the memory-mapped columns are
+    read-only.
+    """
+    name = 'plain' if funct is None else funct.__name__
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)), CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+    cache = os.path.join(cache_dir, '%s.%s' % (os.path.basename(path), name))
+    st = os.stat(path)
+    meta = None
+    if os.path.exists(os.path.join(cache, 'meta.json')):
+        with open(os.path.join(cache, 'meta.json')) as f:
+            meta = json.load(f)
+        if (meta['mtime_ns'], meta['size']) != (st.st_mtime_ns, st.st_size):
+            if meta['hash'] == _fileHash(path):
+                #same contents, remember the new mtime
+                meta['mtime_ns'], meta['size'] = st.st_mtime_ns, st.st_size
+                _writeMeta(cache, meta)
+            else:
+                meta = None
+    if meta is None:
+        df = pd.read_pickle(path)
+        if funct is not None:
+            df = funct(df)
+        meta = _writeCache(df, cache, {'mtime_ns': st.st_mtime_ns, 'size': st.st_size,
+                                       'hash': _fileHash(path)})
+    return _readCache(cache, meta)
+
 def readFA_IRData(inpath, filename, funct):
     return funct(pd.read_pickle(inpath+filename))
-    
-def getAllFA_IRData(inpath, funct):
+
+def _readAll(inpath, funct, cache, n_jobs):
+    #read all rankings of an experiment in parallel
+    if cache:
+        read = lambda f: cachedFA_IRData(inpath+f, funct)
+    elif funct is None:
+        read = lambda f: pd.read_pickle(inpath+f)
+    else:
+        read = lambda f: readFA_IRData(inpath, f, funct)
+    with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+        frames = pool.map(read, [f for _, f in FA_IR_FILES])
+        return dict(zip([k for k, _ in FA_IR_FILES], frames))
+
+def getAllFA_IRData(inpath, funct, cache=True, n_jobs=4):
+    frames = _readAll(inpath, funct, cache, n_jobs)
     d ={}
 
-    d['cb'] = readFA_IRData(inpath, 'ColorblindRanking.pickle', funct)
+    d['cb'] = frames['cb']
     d['base'] = d['cb'].copy()
     d['base']['y_pred']=d['base']['y']
-    d['feld'] = readFA_IRData(inpath, 'FeldmanRanking.pickle', funct)
+    d['feld'] = frames['feld']
     d['feld']['y'] = d['cb']['y']
-    d['fair1'] = readFA_IRData(inpath, 'FairRanking01PercentProtected.pickle', funct)
-    d['fair2'] = readFA_IRData(inpath, 'FairRanking02PercentProtected.pickle', funct)
-    d['fair3'] = readFA_IRData(inpath, 'FairRanking03PercentProtected.pickle', funct)
-    d['fair4'] = readFA_IRData(inpath, 'FairRanking04PercentProtected.pickle', funct)
-    d['fair5'] = readFA_IRData(inpath, 'FairRanking05PercentProtected.pickle', funct)
-    d['fair6'] = readFA_IRData(inpath, 'FairRanking06PercentProtected.pickle', funct)
-    d['fair7'] = readFA_IRData(inpath, 'FairRanking07PercentProtected.pickle', funct)
-    d['fair8'] = readFA_IRData(inpath, 'FairRanking08PercentProtected.pickle', funct)
-    d['fair9'] = readFA_IRData(inpath, 'FairRanking09PercentProtected.pickle', funct)
+    for i in range(1, 10):
+        d['fair%d' % i] = frames['fair%d' % i]
     return d
 
-def plainFA_IRData(inpath):
+def plainFA_IRData(inpath, cache=True, n_jobs=4):
+    frames = _readAll(inpath, None, cache, n_jobs)
     d ={}
 
-    d['cb'] = pd.read_pickle(inpath+'ColorblindRanking.pickle')
+    d['cb'] = frames['cb']
     d['base'] = d['cb'].copy()
     d['base']['y_pred']=d['base']['y']
-    d['feld'] = pd.read_pickle(inpath+'FeldmanRanking.pickle')
+    d['feld'] = frames['feld']
     d['feld']['y'] = d['cb']['y']
-    d['fair1'] = pd.read_pickle(inpath+'FairRanking01PercentProtected.pickle')
-    d['fair2'] = pd.read_pickle(inpath+'FairRanking02PercentProtected.pickle')
-    d['fair3'] = pd.read_pickle(inpath+'FairRanking03PercentProtected.pickle')
-    d['fair4'] = pd.read_pickle(inpath+'FairRanking04PercentProtected.pickle')
-    d['fair5'] = pd.read_pickle(inpath+'FairRanking05PercentProtected.pickle')
-    d['fair6'] = pd.read_pickle(inpath+'FairRanking06PercentProtected.pickle')
-    d['fair7'] = pd.read_pickle(inpath+'FairRanking07PercentProtected.pickle')
-    d['fair8'] = pd.read_pickle(inpath+'FairRanking08PercentProtected.pickle')
-    d['fair9'] = pd.read_pickle(inpath+'FairRanking09PercentProtected.pickle')
-    return d
\ No newline at end of file
+    for i in range(1, 10):
+        d['fair%d' % i] = frames['fair%d' % i]
+    return d
@@ -10,22 +10,104 @@
 # Authors: Caitlin Kuhlman <cakuhlman@wpi.edu>
 # License: BSD 3 clause
 
+import heapq
+import time
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 from scipy import stats
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from fare.metrics import rank_parity, rank_equality, rank_calibration
+from fare.metrics import _presort, _rank_parity_sorted, _rank_equality_sorted, _rank_calibration_sorted
+from fare.metrics import _segment_inversions, _parity_errors, _equality_errors, _calibration_errors
+from fare.metrics import _pairs, _above_counts, _inversion_matrix
+from fare.instrument import phase
 
 __ALL__ = [
     "audit_parity",
     "audit_equality",
-    "audit_calibration"
-    "generate_diagnostics"
-    "plot_audit"
+    "audit_calibration",
+    "audit_multiresolution",
+    "audit_budgeted",
+    "worst_segment",
+    "generate_diagnostics",
+    "generate_diagnostics_batch",
+    "plot_audit",
+    "plot_audits"
 ]
 
 
+def _window_starts(n, window, step):
+    """Return the start index of every audit window, including the end of rank window."""
+    if window > n:
+        raise ValueError("window (%d) is larger than the ranking (%d)" % (window, n))
+    starts = np.arange(0, n - window, step)
+    nxt = starts[-1] + step if len(starts) else 0
+    #get end of rank if needed
+    if nxt > n - window:
+        starts = np.append(starts, n - window)
+    return starts
+
+
+def _windows(a, window, step):
+    """Return zero-copy views of every audit window of the sorted array a."""
+    views = sliding_window_view(a, window)
+    return [views[s] for s in _window_starts(len(a), window, step)]
+
+
+def _bin_edges(y_sorted, bins):
+    """Return bin edges as positions in the sorted ranking."""
+    n = len(y_sorted)
+    if isinstance(bins, str):
+        kind, _, k = bins.partition(':')
+        if kind != 'quantile' or not k.isdigit() or int(k) < 1:
+            raise ValueError("bins must be an array of edges or 'quantile:k', got %r" % bins)
+        q = np.quantile(y_sorted, np.linspace(0, 1, int(k) + 1)[1:-1])
+        cuts = np.searchsorted(y_sorted, q, side='left')
+        return np.concatenate(([0], cuts, [n]))
+    edges = np.clip(np.asarray(bins, dtype=int), 0, n)
+    if len(edges) < 2 or np.any(np.diff(edges) < 0):
+        raise ValueError("bin edges must be increasing and contain at least two values")
+    return edges
+
+
+def _bin_ids(edges):
+    """Return the bin id of every item covered by the edges."""
+    return np.repeat(np.arange(len(edges) - 1), np.diff(edges))
+
+
+def _audit_parity_segments(g, s, e):
+    #prefix counts of group 1 items, group 0 items and group 0 items preceding each group 1 item
+    ones = np.concatenate(([0], np.cumsum(g)))
+    zeros = np.arange(len(g) + 1) - ones
+    before = np.concatenate(([0], np.cumsum(zeros[:-1] * g)))
+    n1 = ones[e] - ones[s]
+    n0 = (e - s) - n1
+    p01 = before[e] - before[s] - zeros[s] * n1
+    return _parity_errors(p01, n0, n1)
+
+
+def _audit_parity_bins(g, edges):
+    return _audit_parity_segments(g, edges[:-1], edges[1:])
+
 
-def audit_parity(y, groups, window, step):
+def _audit_inversion_bins(t, g, m, edges, errors):
+    t, g = t[edges[0]:edges[-1]], g[edges[0]:edges[-1]]
+    seg = _bin_ids(edges - edges[0])
+    c = _segment_inversions(t, g, m, seg, len(edges) - 1)
+    n1 = np.bincount(seg, weights=g, minlength=len(edges) - 1).astype(np.int64)
+    return errors(c, np.diff(edges) - n1, n1)
+
+
+def _check_window(window, step):
+    if window is None or step is None:
+        raise ValueError("window and step are required unless bins are given")
+
+
+def audit_parity(y, groups, window=None, step=None, bins=None):
     """Generate the error sequences for rank auditing using the rank parity metric. 
 
     Parameters
@@ -41,6 +123,12 @@ def audit_parity(y, groups, window, step):
         
     step : int
         Step size for sliding window.
+
+    bins : array-like or str, optional
+        Audit contiguous bins instead of sliding windows. Either increasing bin
+        edges given as positions in the sorted ranking, e.g. [0, 10, 50, 200],
+        or "quantile:k" for k bins of equal score quantiles. When given, window
+        and step are ignored.
         
     Returns
     -------
@@ -54,34 +142,28 @@ def audit_parity(y, groups, window, step):
     --------
     
     """    
+    #sort groups by rank value
+    with phase('audit_parity.sort', size=len(groups)):
+        r = np.asarray(y).argsort()
+        g = np.asarray(groups, dtype=int)[r]
+    if bins is not None:
+        with phase('audit_parity.bins', size=len(g)):
+            e0, e1 = _audit_parity_bins(g, _bin_edges(np.asarray(y)[r], bins))
+        return list(e0), list(e1)
+    _check_window(window, step)
     #error sequences
     err0=[]
     err1=[]
-    start=0
-    end=window
-    
-    #perform binning
-    r = np.transpose([y,groups])
-    #sort values by rank value
-    r = r[r[:,0].argsort()]
-
-    while end<len(r):
-        vals = r[start:end]
-        e0,e1 = rank_parity(vals[:,0],vals[:,1])
-        err0.append(e0)
-        err1.append(e1)
-        start+=step
-        end+=step
-    #get end of rank is needed
-    if(start > len(r)-window):
-        vals = r[len(r)-window:]
-        e0,e1 = rank_parity(vals[:,0],vals[:,1])
-        err0.append(e0)
-        err1.append(e1)
+    windows = _windows(g, window, step)
+    with phase('audit_parity.windows', size=window, windows=len(windows)):
+        for vals in windows:
+            e0,e1 = _rank_parity_sorted(vals)
+            err0.append(e0)
+            err1.append(e1)
     return err0, err1
 
 
-def audit_equality(y_true, y_pred, groups, window, step):
+def audit_equality(y_true, y_pred, groups, window=None, step=None, bins=None):
     """Generate the error sequences for rank auditing using the rank equality metric. 
 
     Parameters
@@ -100,6 +182,12 @@ def audit_equality(y_true, y_pred, groups, window, step):
         
     step : int
         Step size for sliding window.
+
+    bins : array-like or str, optional
+        Audit contiguous bins instead of sliding windows. Either increasing bin
+        edges given as positions in the sorted ranking, e.g. [0, 10, 50, 200],
+        or "quantile:k" for k bins of equal score quantiles. When given, window
+        and step are ignored.
         
     Returns
     -------
@@ -113,33 +201,27 @@ def audit_equality(y_true, y_pred, groups, window, step):
     --------
     
     """     
+    #sort true value ranks and groups by predicted value
+    t, g, m = _presort(y_true, y_pred, groups)
+    if bins is not None:
+        with phase('audit_equality.bins', size=len(g)):
+            edges = _bin_edges(np.sort(np.asarray(y_pred)), bins)
+            e0, e1 = _audit_inversion_bins(t, g, m, edges, _equality_errors)
+        return list(e0), list(e1)
+    _check_window(window, step)
     #error sequences
     err0=[]
     err1=[]
-    start=0
-    end=window
-    
-    #perform binning
-    r = np.transpose([y_true,y_pred,groups])
-    #sort values by predicted value
-    r = r[r[:,1].argsort()]
-    while end<len(r):
-        vals = r[start:end]
-        e0,e1 = rank_equality(vals[:,0],vals[:,1],vals[:,2])
-        err0.append(e0)
-        err1.append(e1)
-        start+=step
-        end+=step
-    #get end of rank if needed
-    if(start > len(r)-window):
-        vals = r[len(r)-window:]
-        e0,e1 = rank_equality(vals[:,0],vals[:,1],vals[:,2])
-        err0.append(e0)
-        err1.append(e1)
+    windows = list(zip(_windows(t, window, step), _windows(g, window, step)))
+    with phase('audit_equality.windows', size=window, windows=len(windows)):
+        for vals, gvals in windows:
+            e0,e1 = _rank_equality_sorted(vals, gvals, m)
+            err0.append(e0)
+            err1.append(e1)
     return err0, err1
 
 
-def audit_calibration(y_true, y_pred, groups, window, step):
+def audit_calibration(y_true, y_pred, groups, window=None, step=None, bins=None):
     """Generate the error sequences for rank auditing using the rank calibration metric. 
 
     Parameters
@@ -158,6 +240,12 @@ def audit_calibration(y_true, y_pred, groups, window, step):
         
     step : int
         Step size for sliding window.
+
+    bins : array-like or str, optional
+        Audit contiguous bins instead of sliding windows. Either increasing bin
+        edges given as positions in the sorted ranking, e.g. [0, 10, 50, 200],
+        or "quantile:k" for k bins of equal score quantiles. When given, window
+        and step are ignored.
         
     Returns
     -------
@@ -171,33 +259,596 @@ def audit_calibration(y_true, y_pred, groups, window, step):
     --------
     
     """         
+    #sort true value ranks and groups by predicted value
+    t, g, m = _presort(y_true, y_pred, groups)
+    if bins is not None:
+        with phase('audit_calibration.bins', size=len(g)):
+            edges = _bin_edges(np.sort(np.asarray(y_pred)), bins)
+            e0, e1 = _audit_inversion_bins(t, g, m, edges, _calibration_errors)
+        return list(e0), list(e1)
+    _check_window(window, step)
     #error sequences
     err0=[]
     err1=[]
-    start=0
-    end=window
-    
-    #perform binning
-    r = np.transpose([y_true,y_pred,groups])
-    #sort values by predicted value
-    r = r[r[:,1].argsort()]
-    
-    while end<len(r):
-        vals = r[start:end]
-        e0,e1 = rank_calibration(vals[:,0],vals[:,1],vals[:,2])
-        err0.append(e0)
-        err1.append(e1)
-        start+=step
-        end+=step
-    #get end of rank if needed
-    if(start > len(r)-window):
-        vals = r[len(r)-window:]
-        e0,e1 = rank_calibration(vals[:,0],vals[:,1],vals[:,2])
-        err0.append(e0)
-        err1.append(e1)
+    windows = list(zip(_windows(t, window, step), _windows(g, window, step)))
+    with phase('audit_calibration.windows', size=window, windows=len(windows)):
+        for vals, gvals in windows:
+            e0,e1 = _rank_calibration_sorted(vals, gvals, m)
+            err0.append(e0)
+            err1.append(e1)
     return err0, err1
 
 
+def _block_run_inversions(t, g, m, b, sizes):
+    """Yield the inversion counts of runs of consecutive blocks of b items.
+
+    For every k in sizes (in increasing order) yields k and an array c of shape
+    (n_blocks - k + 1, 2, 2) where c[s] holds the counts of _inversion_matrix for
+    the k blocks starting at block s. Runs grow one block at a time, adding the
+    pairs between the new last block and every earlier block of the run, so all
+    sizes up to the largest are answered from one pass.
+    """
+    n_blocks = len(t) // b
+    t, g = t[:n_blocks * b], g[:n_blocks * b]
+    blk = np.arange(len(t)) // b
+    within = _segment_inversions(t, g, m, blk, n_blocks)
+    #ranks offset by block, sorted per group, and where each block ends in them
+    key = blk * m + t
+    keys = [np.sort(key[g == y]) for y in range(2)]
+    ends = [np.searchsorted(keys[y], (np.arange(n_blocks) + 1) * m) for y in range(2)]
+    #pairs between block J and the blocks up to d before it
+    cross = np.zeros((n_blocks, 2, 2), dtype=np.int64)
+    runs = within
+    sizes = set(sizes)
+    for k in range(1, max(sizes) + 1):
+        if k > 1:
+            d = k - 1
+            later, earlier = blk[d * b:], blk[d * b:] - d
+            q = earlier * m + t[d * b:]
+            for y in range(2):
+                larger = ends[y][earlier] - np.searchsorted(keys[y], q, side='right')
+                cross[:, :, y] += np.bincount(2 * later + g[d * b:], weights=larger,
+                                              minlength=2 * n_blocks).reshape(-1, 2).astype(np.int64)
+            runs = runs[:-1] + within[k - 1:] + cross[k - 1:]
+        if k in sizes:
+            yield k, runs
+
+
+# ratio of the per window audit cost of the items of a window to one pass of the block counts
+_MULTIRES_PASS_ITEMS = 16
+
+def audit_multiresolution(y_true, y_pred, groups, windows, steps, metric='parity'):
+    """Generate the error sequences for several window sizes at once.
+
+    Equivalent to calling audit_parity, audit_equality or audit_calibration once
+    for every window size, but the ranking is sorted once and shared. Parity
+    errors of any window come from prefix counts in constant time. For equality
+    and calibration the ranking is cut into blocks whose size divides every
+    window and step, and the inverted pairs between blocks are accumulated once
+    for all sizes up to the largest window, after which every window is a
+    lookup. Building the block counts costs about one sorted search over the
+    ranking per block in the largest window, so coarse, common block sizes are
+    fastest. When the block counts would cost more than auditing every window
+    size on its own, e.g. windows [500, 1001] share no common block larger
+    than one item, the sizes are audited on their own instead.
+
+    Parameters
+    ----------
+    y_true : array-like of shape = (n_samples)
+        Ground truth (correct) target values. Ignored for the parity metric.
+
+    y_pred : array-like of shape = (n_samples)
+        Estimated target values.
+
+    groups : array-like of shape = (n_samples)
+        Binary integer array with group labels for each sample.
+
+    windows : array-like of int
+        The window sizes to audit.
+
+    steps : int or array-like of int
+        Step size for the sliding window, shared or one per window size.
+
+    metric : str, optional
+        One of 'parity', 'equality' or 'calibration'.
+
+    Returns
+    -------
+    errors : dict
+        Maps every window size to its pair of error sequences (error0, error1),
+        as returned by the matching audit function.
+
+    Examples
+    --------
+    >>> y_pred = [1,2,3,4,5,6,7,8]
+    >>> groups = [0,1,0,1,1,1,0,0]
+    >>> audit_multiresolution(None, y_pred, groups, [2, 4], 2)[4]
+    ([0.75, 1.0], [0.25, 0.0])
+    """
+    windows = [int(w) for w in windows]
+    steps = [int(x) for x in np.broadcast_to(steps, len(windows))]
+    if metric == 'parity':
+        g = np.asarray(groups, dtype=int)[np.asarray(y_pred).argsort()]
+        errors = {}
+        for w, step in zip(windows, steps):
+            starts = _window_starts(len(g), w, step)
+            e0, e1 = _audit_parity_segments(g, starts, starts + w)
+            errors[w] = (e0.tolist(), e1.tolist())
+        return errors
+    if metric not in ('equality', 'calibration'):
+        raise ValueError("metric must be 'parity', 'equality' or 'calibration', got %r" % metric)
+    errors_fnc = _equality_errors if metric == 'equality' else _calibration_errors
+
+    t, g, m = _presort(y_true, y_pred, groups)
+    n = len(g)
+    starts = {w: _window_starts(n, w, step) for w, step in zip(windows, steps)}
+    b = int(np.gcd.reduce(windows + steps))
+    #a pass of the block counts costs about as much as _MULTIRES_PASS_ITEMS items audited
+    #per window, audit every size on its own when the common block is too small
+    if max(windows) // b > _MULTIRES_PASS_ITEMS * sum(w / float(step) for w, step in zip(windows, steps)):
+        sorted_fnc = _rank_equality_sorted if metric == 'equality' else _rank_calibration_sorted
+        errors = {}
+        with phase('audit_multiresolution.windows', size=n, windows=sum(len(s) for s in starts.values())):
+            for w in windows:
+                e = [sorted_fnc(t[s:s + w], g[s:s + w], m) for s in starts[w]]
+                errors[w] = ([float(x[0]) for x in e], [float(x[1]) for x in e])
+        return errors
+    ones = np.concatenate(([0], np.cumsum(g)))
+    errors = {}
+    with phase('audit_multiresolution.windows', size=n, windows=sum(len(s) for s in starts.values())):
+        for k, runs in _block_run_inversions(t, g, m, b, [w // b for w in windows]):
+            w = k * b
+            s = starts[w]
+            c = np.zeros((len(s), 2, 2), dtype=np.int64)
+            #only the end of rank window may not start on a block
+            aligned = (s % b == 0) & (s // b < len(runs))
+            c[aligned] = runs[s[aligned] // b]
+            for i in np.flatnonzero(~aligned):
+                c[i] = _inversion_matrix(t[s[i]:s[i] + w], g[s[i]:s[i] + w], m)
+            n1 = ones[s + w] - ones[s]
+            e0, e1 = errors_fnc(c, w - n1, n1)
+            errors[w] = (e0.tolist(), e1.tolist())
+    return errors
+
+
+def _van_der_corput_order(k):
+    """Return a permutation of range(k) in coarse-to-fine order.
+
+    Indices are ordered by their bit-reversed value (the base 2 van der Corput
+    sequence), so every prefix of the order is spread over the whole range.
+    """
+    if k <= 1:
+        return np.arange(k)
+    bits = int(np.ceil(np.log2(k)))
+    i = np.arange(2 ** bits)
+    rev = np.zeros_like(i)
+    for b in range(bits):
+        rev |= ((i >> b) & 1) << (bits - 1 - b)
+    return rev[rev < k]
+
+
+def audit_budgeted(y_true, y_pred, groups, window, step, metric='equality', time_budget=None,
+                   max_windows=None, progress=None, cancel=None, order='sequential'):
+    """Generate the error sequences of an audit under a time or window budget.
+
+    Windows are computed one at a time. Before each window the audit stops if
+    the time budget is spent, max_windows windows are done or cancel is set,
+    and returns the windows computed so far. With order='coarse_to_fine'
+    windows are visited in van der Corput order (first, middle, quarters, ...)
+    so that an early stop still covers the whole ranking at a coarser step.
+
+    Parameters
+    ----------
+    y_true : array-like of shape = (n_samples)
+        Ground truth (correct) target values. Ignored for the parity metric.
+
+    y_pred : array-like of shape = (n_samples)
+        Estimated target values.
+
+    groups : array-like of shape = (n_samples)
+        Binary integer array with group labels for each sample.
+
+    window : int
+        The number of instances in each bin.
+
+    step : int
+        Step size for sliding window.
+
+    metric : str, optional
+        One of 'parity', 'equality' or 'calibration'.
+
+    time_budget : float, optional
+        Maximum time in seconds spent computing windows.
+
+    max_windows : int, optional
+        Maximum number of windows computed.
+
+    progress : callable, optional
+        Called as progress(done, total) after every window.
+
+    cancel : threading.Event, optional
+        Stops the audit before the next window once set, e.g. from another
+        thread or from the progress callback.
+
+    order : str, optional
+        'sequential' or 'coarse_to_fine'.
+
+    Returns
+    -------
+    starts : array of shape = (n_computed)
+        Positions in the sorted ranking of the computed windows, increasing.
+        The audit completed if it holds every window, len(starts) equals the
+        number of windows of audit_equality with the same window and step.
+
+    error0 : array-like of shape = (n_computed)
+        The error sequence for group 0 of the computed windows.
+
+    error1 : array-like of shape = (n_computed)
+        The error sequence for group 1 of the computed windows.
+
+    Examples
+    --------
+    >>> y_pred = [1,2,3,4,5,6,7,8]
+    >>> groups = [0,1,0,1,1,1,0,0]
+    >>> audit_budgeted(None, y_pred, groups, 2, 1, metric='parity', max_windows=3, order='coarse_to_fine')
+    (array([0, 2, 4]), [1.0, 1.0, 0.0], [0.0, 0.0, 1.0])
+    """
+    if metric == 'parity':
+        g = np.asarray(groups, dtype=int)[np.asarray(y_pred).argsort()]
+        t, m = None, None
+    elif metric in ('equality', 'calibration'):
+        t, g, m = _presort(y_true, y_pred, groups)
+    else:
+        raise ValueError("metric must be 'parity', 'equality' or 'calibration', got %r" % metric)
+    if order not in ('sequential', 'coarse_to_fine'):
+        raise ValueError("order must be 'sequential' or 'coarse_to_fine', got %r" % order)
+    starts = _window_starts(len(g), window, step)
+    visit = np.arange(len(starts)) if order == 'sequential' else _van_der_corput_order(len(starts))
+    deadline = None if time_budget is None else time.perf_counter() + time_budget
+    done = []
+    errors = {}
+    with phase('audit_budgeted.windows', size=window):
+        for i in visit:
+            if ((max_windows is not None and len(done) >= max_windows)
+                    or (cancel is not None and cancel.is_set())
+                    or (deadline is not None and time.perf_counter() >= deadline)):
+                break
+            s = starts[i]
+            if metric == 'parity':
+                errors[i] = _rank_parity_sorted(g[s:s + window])
+            elif metric == 'equality':
+                errors[i] = _rank_equality_sorted(t[s:s + window], g[s:s + window], m)
+            else:
+                errors[i] = _rank_calibration_sorted(t[s:s + window], g[s:s + window], m)
+            done.append(i)
+            if progress is not None:
+                progress(len(done), len(starts))
+    done = sorted(done)
+    return starts[done], [float(errors[i][0]) for i in done], [float(errors[i][1]) for i in done]
+
+
+# blocks with at most this many candidate segments are evaluated exhaustively
+_SEARCH_LEAF = 4096
+# number of cached segment prefixes kept by the search
+_SEARCH_CACHE = 2**22
+# start positions searched together, in multiples of the minimum segment length
+_SEARCH_CHUNK = 8
+
+def _segment_counter(metric, t, g, m):
+    """Return functions giving the error numerators and denominators of segments.
+
+    counts(s, e) returns num0, num1, den0, den1 of the segment [s, e) and whether
+    it contains both groups. block(s_lo, s_hi, e_lo, e_hi) returns the same as
+    2-d arrays over all segments with s_lo <= s <= s_hi and e_lo <= e <= e_hi.
+    prepare(starts, e) precomputes the segments up to e (one per start, or
+    shared) of several starts at once. For equality and calibration, parts(s, e)
+    returns the inverted pairs between the groups, within group 0 and within
+    group 1 of the segment, followed by its pairs of the same kinds.
+    """
+    ones = np.concatenate(([0], np.cumsum(g)))
+    zeros = np.arange(len(g) + 1) - ones
+    if metric == 'parity':
+        before = np.concatenate(([0], np.cumsum(zeros[:-1] * g)))
+        #plain lists are faster for scalar lookups
+        ones_l, zeros_l, before_l = ones.tolist(), zeros.tolist(), before.tolist()
+        def counts(s, e):
+            n1 = ones_l[e] - ones_l[s]
+            p = (e - s - n1) * n1
+            p01 = before_l[e] - before_l[s] - zeros_l[s] * n1
+            return p01, p - p01, p, p, p > 0
+        def block(s_lo, s_hi, e_lo, e_hi):
+            s = np.arange(s_lo, s_hi + 1)[:, None]
+            e = np.arange(e_lo, e_hi + 1)[None, :]
+            n1 = ones[e] - ones[s]
+            p = ((e - s) - n1) * n1
+            p01 = before[e] - before[s] - zeros[s] * n1
+            return p01, p - p01, p, p, p > 0
+        def prepare(starts, e):
+            pass
+        return counts, block, prepare, None
+    if metric not in ('equality', 'calibration'):
+        raise ValueError("metric must be 'parity', 'equality' or 'calibration', got %r" % metric)
+
+    #cumulative inverted pair counts of the segments starting at s, least recently used first
+    cache = OrderedDict()
+    cached = [0]
+    def prepare(starts, e):
+        e = np.broadcast_to(e, len(starts))
+        todo = [(s, x) for s, x in zip(starts, e) if s not in cache or len(cache[s]) <= x - s]
+        if not todo:
+            return
+        starts, e = zip(*todo)
+        #extend past e since nearby segments with the same start are likely next,
+        #and count the inversions of all segments in one pass
+        stops = [min(len(g), s + 2 * (x - s)) for s, x in zip(starts, e)]
+        lens = np.subtract(stops, starts)
+        seg = np.repeat(np.arange(len(starts)), lens)
+        items = np.concatenate([np.arange(s, x) for s, x in zip(starts, stops)])
+        gs = g[items]
+        above = _above_counts(seg * m + t[items], gs, len(starts) * m)
+        cum = np.zeros((len(items) + 1, 2, 2), dtype=np.int64)
+        for x in range(2):
+            for y in range(2):
+                cum[1:, x, y] = np.cumsum(above[:, y] * (gs == x))
+        offsets = np.concatenate(([0], np.cumsum(lens)))
+        for i, s in enumerate(starts):
+            if s in cache:
+                cached[0] -= len(cache.pop(s))
+            cache[s] = cum[offsets[i]:offsets[i + 1] + 1] - cum[offsets[i]]
+            cached[0] += lens[i] + 1
+        while cached[0] > _SEARCH_CACHE and len(cache) > 1:
+            cached[0] -= len(cache.popitem(last=False)[1])
+
+    def prefix(s, e):
+        if s not in cache or len(cache[s]) <= e - s:
+            prepare([s], e)
+        cache.move_to_end(s)
+        return cache[s]
+
+    def errors(c, n, n0, n1):
+        if metric == 'equality':
+            p = n0 * n1
+            return c[..., 0, 1], c[..., 1, 0], p, p, p > 0
+        mixed = c[..., 0, 1] + c[..., 1, 0]
+        return (mixed + c[..., 0, 0], mixed + c[..., 1, 1],
+                _pairs(n) - _pairs(n1), _pairs(n) - _pairs(n0), n0 * n1 > 0)
+
+    def counts(s, e):
+        (c00, c01), (c10, c11) = prefix(s, e)[e - s].tolist()
+        n1 = int(ones[e] - ones[s])
+        n0 = e - s - n1
+        if metric == 'equality':
+            return c01, c10, n0 * n1, n0 * n1, n0 * n1 > 0
+        mixed = c01 + c10
+        return (mixed + c00, mixed + c11,
+                _pairs(e - s) - _pairs(n1), _pairs(e - s) - _pairs(n0), n0 * n1 > 0)
+
+    def parts(s, e):
+        (c00, c01), (c10, c11) = prefix(s, e)[e - s].tolist()
+        n1 = int(ones[e] - ones[s])
+        n0 = e - s - n1
+        return c01 + c10, c00, c11, n0 * n1, _pairs(n0), _pairs(n1)
+
+    def block(s_lo, s_hi, e_lo, e_hi):
+        stop = max(e_hi, s_hi)
+        k = s_hi - s_lo
+        a = np.arange(k + 1)
+        e = np.arange(e_lo, e_hi + 1)
+        #segments [s, e) are segments [s_lo, e) less the pairs within or leaving [s_lo, s)
+        base = prefix(s_lo, stop)
+        c = base[e - s_lo][None] - base[a][:, None]
+        ts, gs = t[s_lo:stop], g[s_lo:stop]
+        head = (ts[:k, None] > ts[None, :]) & (a[:k, None] < np.arange(stop - s_lo)[None, :])
+        for y in range(2):
+            #inverted pairs from the first a items into each later item
+            leaving = np.zeros((k + 1, stop - s_lo), dtype=np.int64)
+            leaving[1:] = np.cumsum(head & (gs[:k] == y)[:, None], axis=0)
+            for x in range(2):
+                cum = np.zeros((k + 1, stop - s_lo + 1), dtype=np.int64)
+                cum[:, 1:] = np.cumsum(leaving * (gs == x), axis=1)
+                c[:, :, x, y] -= cum[:, e - s_lo] - cum[a, a][:, None]
+        s = (s_lo + a)[:, None]
+        n1 = ones[e][None, :] - ones[s]
+        n0 = (e[None, :] - s) - n1
+        return errors(c, e[None, :] - s, n0, n1)
+
+    return counts, block, prepare, parts
+
+
+# intervals of the number of added mixed pairs bounded separately
+_CALIBRATION_BOUND_STEPS = 8
+
+def _calibration_gap_bound(inner, outer, x):
+    """Bound error_x - error_other of rank calibration over the segments between two.
+
+    inner and outer are the parts of the shortest and longest segments of a
+    block, as returned by parts: the inverted mixed, within group 0 and within
+    group 1 pairs, and the mixed, group 0 and group 1 pairs. Both errors count
+    the inverted mixed pairs, so those are added to both at once: error_x gets
+    all the inversions it can among its own added pairs, the other error none
+    among its own, and the mixed inversions dm <= dq are optimized jointly
+    for every interval of added mixed pairs dq.
+    """
+    im, iq, om, oq = inner[0], inner[3], outer[0], outer[3]
+    ia, ida, oa = inner[1 + x], inner[4 + x], outer[1 + x]
+    ib, idb, ob, odb = inner[2 - x], inner[5 - x], outer[2 - x], outer[5 - x]
+    #only segments with mixed pairs are valid
+    q_start = max(0, 1 - iq)
+    if q_start > oq - iq:
+        return -1.
+    #every pair added to the inner segment is either inverted or not, so error_x
+    #is largest with the added inverted pairs of its own group only, and the
+    #other error smallest with the added pairs that are not inverted only
+    n, r0 = im + ia + (oa - ia), iq + ida + (oa - ia)
+    n1, r1 = im + ib, iq + idb + (odb - idb) - (ob - ib)
+    #the added mixed pairs dq hold dm inverted ones, at most all the added
+    #inverted ones and at least those not left out of the outer segment
+    mm, mq = om - im, oq - iq
+    edges = np.linspace(q_start, mq, _CALIBRATION_BOUND_STEPS + 1)
+    ql, qh = edges[:-1], edges[1:]
+    bottom = np.maximum(0, mm - mq + ql)
+    top = np.maximum(np.minimum(qh, mm), bottom)
+    #the bound is linear in dm below ql and concave above it
+    stationary = np.sqrt((r0 - n) * (r1 + qh)) - r0
+    best = -np.inf
+    for d in (bottom, np.clip(ql, bottom, top), np.clip(stationary, np.maximum(ql, bottom), top), top):
+        best = max(best, np.max((n + d) / (r0 + np.maximum(ql, d)) - (n1 + d) / (r1 + qh)))
+    return best
+
+
+def worst_segment(y_true, y_pred, groups, min_length, metric='parity', max_length=None, tol=0.):
+    """Find the contiguous segment of a ranking with the largest gap between the group errors.
+
+    Searches all segments of the ranking (sorted by y_pred) with at least
+    min_length items and both groups present for the one maximizing
+    abs(error0 - error1). Segments are explored by branch and bound over blocks
+    of candidate start and end positions: pair counts only grow with the
+    segment, so the counts of the shortest and longest segment of a block bound
+    the errors of every segment in it, and blocks that cannot beat the best
+    segment found so far are pruned.
+
+    Parity pair counts of any segment come from prefix counts in constant time,
+    and the search stays fast on rankings of 1e6 items. Equality and
+    calibration count the inverted pairs of all segments sharing a start in one
+    pass and cache them, which is more expensive. Their bounds are also looser:
+    the equality search remains exact and practical up to about 1e5 items,
+    while the calibration bounds, whose errors share the inverted pairs between
+    the groups but not their denominators, still leave a large fraction of all
+    segments to evaluate, so its running time grows quadratically and it is
+    practical up to about 1e4 items. A max_length limits the segments
+    searched; a positive tol prunes only blocks whose bound is within tol of
+    the best gap and shortens the calibration search little.
+
+    Parameters
+    ----------
+    y_true : array-like of shape = (n_samples)
+        Ground truth (correct) target values. Ignored for the parity metric.
+
+    y_pred : array-like of shape = (n_samples)
+        Estimated target values.
+
+    groups : array-like of shape = (n_samples)
+        Binary integer array with group labels for each sample.
+
+    min_length : int
+        The minimum number of instances in the segment.
+
+    metric : str, optional
+        One of 'parity', 'equality' or 'calibration'.
+
+    max_length : int, optional
+        The maximum number of instances in the segment.
+
+    tol : float, optional
+        Blocks that cannot improve the gap by more than tol are pruned. A
+        positive tolerance trades exactness for speed.
+
+    Returns
+    -------
+    start : int
+        Position in the sorted ranking of the first instance of the segment.
+
+    end : int
+        Position in the sorted ranking after the last instance of the segment.
+
+    error0 : float
+        The error of the segment for group 0.
+
+    error1 : float
+        The error of the segment for group 1.
+
+    Examples
+    --------
+    >>> y_pred = [1,2,3,4,5,6,7,8]
+    >>> groups = [0,1,0,1,1,1,0,0]
+    >>> worst_segment(None, y_pred, groups, 4)
+    (2, 6, 1.0, 0.0)
+    """
+    if metric == 'parity':
+        t, m = None, None
+        g = np.asarray(groups, dtype=int)[np.asarray(y_pred).argsort()]
+    else:
+        t, g, m = _presort(y_true, y_pred, groups)
+    n = len(g)
+    max_length = n if max_length is None else min(max_length, n)
+    if min_length < 1:
+        raise ValueError("min_length must be at least 1, got %d" % min_length)
+    if min_length > max_length:
+        raise ValueError("min_length (%d) is larger than the ranking (%d)" % (min_length, n))
+    counts, block, prepare, parts = _segment_counter(metric, t, g, m)
+
+    best = [-1., None]
+    def consider(s, e, num0, num1, den0, den1, valid):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            e0, e1 = num0 / den0, num1 / den1
+            gap = np.where(valid, np.abs(e0 - e1), -1.)
+        i = np.unravel_index(np.argmax(gap), gap.shape)
+        if gap[i] > best[0]:
+            best[0], best[1] = gap[i], (s[i[0]], e[i[-1]], e0[i], e1[i])
+
+    def bound(s_lo, s_hi, e_lo, e_hi):
+        if metric == 'calibration':
+            outer = parts(s_lo, e_hi)
+            inner = parts(s_hi, e_lo) if e_lo > s_hi else (0,) * 6
+            return max(_calibration_gap_bound(inner, outer, 0), _calibration_gap_bound(inner, outer, 1))
+        o0, o1, od0, od1, _ = counts(s_lo, e_hi)
+        if od0 == 0:
+            return -1.
+        i0, i1, id0, id1, _ = counts(s_hi, e_lo) if e_lo > s_hi else (0, 0, 0, 0, False)
+        #parity and equality errors share a denominator and count disjoint pairs
+        dn0 = min(o0 - i0, od0 - id0)
+        dn1 = min(o1 - i1, od0 - id0)
+        return max(1. if id0 + dn0 == 0 else (i0 - i1 + dn0) / (id0 + dn0),
+                   1. if id0 + dn1 == 0 else (i1 - i0 + dn1) / (id0 + dn1))
+
+    #seed with the windows of minimum length
+    seeds = np.arange(0, n - min_length + 1, max(1, min_length // 2))
+    for i in range(0, len(seeds), 64):
+        chunk = seeds[i:i + 64]
+        prepare(chunk, chunk + min_length)
+        found = np.array([counts(s, s + min_length) for s in chunk.tolist()])
+        consider(chunk, chunk + min_length, *found.T)
+
+    #search the start positions chunk by chunk so cached segments are reused
+    chunk = _SEARCH_CHUNK * min_length
+    for c in range(0, n - min_length + 1, chunk):
+        heap = [(-np.inf, (c, min(c + chunk, n - min_length + 1) - 1, c + min_length, n))]
+        while heap:
+            b, (s_lo, s_hi, e_lo, e_hi) = heapq.heappop(heap)
+            if -b <= best[0] + tol:
+                break
+            if (s_hi - s_lo + 1) * (e_hi - e_lo + 1) <= _SEARCH_LEAF:
+                s = np.arange(s_lo, s_hi + 1)
+                e = np.arange(e_lo, e_hi + 1)
+                with phase('worst_segment.block', segments=len(s) * len(e)):
+                    num0, num1, den0, den1, valid = block(s_lo, s_hi, e_lo, e_hi)
+                length = e[None, :] - s[:, None]
+                valid = valid & (length >= min_length) & (length <= max_length)
+                consider(s, e, num0, num1, den0, den1, valid)
+                continue
+            #split the wider range of candidate positions
+            if s_hi - s_lo >= e_hi - e_lo:
+                mid = (s_lo + s_hi) // 2
+                children = [(s_lo, mid, e_lo, e_hi), (mid + 1, s_hi, e_lo, e_hi)]
+            else:
+                mid = (e_lo + e_hi) // 2
+                children = [(s_lo, s_hi, e_lo, mid), (s_lo, s_hi, mid + 1, e_hi)]
+            children = [(s_lo, s_hi, e_lo, e_hi) for s_lo, s_hi, e_lo, e_hi in children
+                        if e_hi - s_lo >= min_length and e_lo - s_hi <= max_length]
+            #the outer and inner segments of both children
+            prepare([c[0] for c in children] + [c[1] for c in children],
+                    [c[3] for c in children] + [max(c[1], c[2]) for c in children])
+            for child in children:
+                cb = bound(*child)
+                if cb > best[0] + tol:
+                    heapq.heappush(heap, (-cb, child))
+
+    if best[1] is None:
+        raise ValueError("no segment contains both groups")
+    s, e, e0, e1 = best[1]
+    return int(s), int(e), e0, e1
+
+
 def generate_diagnostics(err0, err1):
     """Generate diagnostic statistics for audit error sequences. 
 
@@ -240,6 +891,171 @@ def generate_diagnostics(err0, err1):
     return diagnostics
 
 
+def _padded(seqs):
+    """Stack sequences of possibly different lengths, returning values and a mask of valid entries."""
+    seqs = [np.asarray(x, dtype=float) for x in seqs]
+    length = max([len(x) for x in seqs] + [0])
+    values = np.zeros((len(seqs), length))
+    mask = np.arange(length)[None, :] < np.array([len(x) for x in seqs], dtype=int)[:, None]
+    values[mask] = np.concatenate(seqs) if seqs else []
+    return values, mask
+
+
+def generate_diagnostics_batch(err0, err1, mask=None):
+    """Generate diagnostic statistics for many pairs of audit error sequences at once.
+
+    Equivalent to calling generate_diagnostics on every pair of rows, with the
+    trends computed as closed form least squares slopes over all rows at once.
+
+    Parameters
+    ----------
+    err0 : array-like of shape = (n_sequences, n_bins) or list of sequences
+        The error sequences for group 0, one per row. Sequences of different
+        lengths are padded at the end.
+
+    err1 : array-like of shape = (n_sequences, n_bins) or list of sequences
+        The error sequences for group 1, with the same shape as err0.
+
+    mask : array-like of shape = (n_sequences, n_bins), optional
+        Boolean array marking the valid entries of every row. The valid
+        entries of a row form its sequence, in order.
+
+    Returns
+    -------
+    trend0 : array of shape = (n_sequences)
+        The trend diagnostic for every row of err0. NaN for rows with fewer
+        than two entries.
+
+    trend1 : array of shape = (n_sequences)
+        The trend diagnostic for every row of err1.
+
+    dist : array of shape = (n_sequences)
+        The distance diagnostic for every pair of rows.
+
+    Examples
+    --------
+    >>> generate_diagnostics_batch([[0, .5, 1], [1, 1]], [[1, 1, 1], [0, .5]])
+    (array([1.5, 0. ]), array([0., 1.]), array([0.5 , 0.75]))
+    """
+    if mask is None:
+        err0, mask = _padded(err0)
+        err1, mask1 = _padded(err1)
+        if mask.shape != mask1.shape or np.any(mask != mask1):
+            raise ValueError("err0 and err1 must have the same shape")
+    else:
+        err0, err1 = np.asarray(err0, dtype=float), np.asarray(err1, dtype=float)
+        mask = np.asarray(mask, dtype=bool)
+        if err0.shape != mask.shape or err1.shape != mask.shape:
+            raise ValueError("err0, err1 and mask must have the same shape")
+    count = mask.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        #x-axis of every valid entry, as in generate_diagnostics
+        x = np.where(mask, (np.cumsum(mask, axis=1) - 1) / count[:, None], 0.)
+        xc = np.where(mask, x - x.sum(axis=1, keepdims=True) / count[:, None], 0.)
+        sxx = (xc ** 2).sum(axis=1)
+        sxx = np.where(count > 1, sxx, np.nan)
+        #centering x is enough since it sums to zero over the valid entries
+        trend0 = (xc * np.where(mask, err0, 0.)).sum(axis=1) / sxx
+        trend1 = (xc * np.where(mask, err1, 0.)).sum(axis=1) / sxx
+        dist = np.where(mask, np.abs(err0 - err1), 0.).sum(axis=1) / count
+    return trend0, trend1, dist
+
+
+# rows of the audit plot and their axis labels
+_PLOT_ROWS = [('parity', "Rpar"), ('calibration', "Rcal"), ('equality', "Req")]
+
+def _draw_audit(axs, errors, title, label):
+    """Draw the error sequence pairs of the three metrics on three stacked axes."""
+    for ax, (metric, name) in zip(axs, _PLOT_ROWS):
+        e0, e1 = errors[metric]
+        ax.plot(e0, color='black', linewidth=2)
+        ax.plot(e1, color='red', linestyle='dashed', linewidth=2)
+        ax.set_yticks([0,0.5,1])
+        ax.set_yticklabels([0.0,0.5,1.0],fontsize = 14)
+        if(label):
+            ax.set_ylabel(name, size=20)
+        else:
+            ax.get_yaxis().set_ticks([])
+    axs[0].set_title(title, size=24) # Title
+    axs[2].xaxis.set_tick_params(labelsize=14)
+    if(label):
+        axs[2].set_xlabel("Windows", size=20)
+
+
+def _render_audits(errors, filenames, titles, label):
+    """Render audit plots to files, reusing one figure outside of pyplot."""
+    fig = Figure(figsize=(2.25, 6))
+    FigureCanvasAgg(fig)
+    axs = fig.subplots(3, 1, sharex='col', sharey='row')
+    try:
+        for i, (err, filename, title) in enumerate(zip(errors, filenames, titles)):
+            if i == 0:
+                _draw_audit(axs, err, title, label)
+            else:
+                #only the data and title change, so keep the artists, then scale
+                #the axes as a fresh plot does: to the data, widened to the ticks
+                for ax, (metric, _) in zip(axs, _PLOT_ROWS):
+                    for line, e in zip(ax.lines, err[metric]):
+                        line.set_data(np.arange(len(e)), e)
+                    ax.relim()
+                    ax.autoscale_view()
+                    ax.set_yticks([0,0.5,1])
+                    if not label:
+                        ax.get_yaxis().set_ticks([])
+                axs[0].set_title(title, size=24)
+            with phase('plot_audits.savefig'):
+                fig.savefig(filename, bbox_inches='tight')
+    finally:
+        fig.clear()
+
+
+def plot_audits(errors, filenames, titles=None, label=True, n_jobs=1):
+    """Plot precomputed audits of many rankings, one file per ranking.
+
+    Produces the same plots as plot_audit from error sequences computed
+    beforehand, e.g. with audit_multiresolution. A single figure is reused for
+    all plots of a process and released when done, without going through the
+    pyplot figure manager.
+
+    Parameters
+    ----------
+    errors : list of dict
+        For every ranking, a dict mapping 'parity', 'calibration' and
+        'equality' to the pair of error sequences (error0, error1).
+
+    filenames : list
+        Name of the output file of every ranking.
+
+    titles : list, optional
+        Title of every plot.
+
+    label : boolean, optional
+        Indicates whether to print the title and axis labels for plots.
+
+    n_jobs : int, optional
+        Number of processes rendering plots in parallel.
+
+    Examples
+    --------
+
+    """
+    errors, filenames = list(errors), list(filenames)
+    titles = [""] * len(errors) if titles is None else list(titles)
+    if not len(errors) == len(filenames) == len(titles):
+        raise ValueError("errors, filenames and titles must have the same length")
+    if n_jobs <= 1 or len(errors) <= 1:
+        _render_audits(errors, filenames, titles, label)
+        return
+    #split the plots into one contiguous chunk per process
+    chunks = np.array_split(np.arange(len(errors)), min(n_jobs, len(errors)))
+    with ProcessPoolExecutor(max_workers=len(chunks)) as pool:
+        jobs = [pool.submit(_render_audits, [errors[i] for i in c], [filenames[i] for i in c],
+                            [titles[i] for i in c], label) for c in chunks]
+        for job in jobs:
+            job.result()
+    return
+
+
 def plot_audit(y_true, y_pred, groups, window, step, title, filename, label=True): 
     """Generate and plot three pairs of error sequences: rank parity, rank calibration, and rank equality. 
        The resulting plot is written to the specified filename.
@@ -277,38 +1093,18 @@ def plot_audit(y_true, y_pred, groups, window, step, title, filename, label=True
     """             
     # plot
     f, axs = plt.subplots(3, 1, sharex='col', sharey='row',figsize=(2.25, 6))
-    
-    e0,e1 = audit_parity(y_pred, groups, window, step)
-    axs[0].plot(e0, color='black' ,linewidth=2)
-    axs[0].plot(e1, color='red', linestyle='dashed',linewidth=2)
-    axs[0].set_yticks([0,0.5,1])
-    axs[0].set_yticklabels([0.0,0.5,1.0],fontsize = 14) 
-    axs[0].set_title(title, size=24) # Title
-                    
-    e0,e1 = audit_calibration(y_true, y_pred, groups, window, step)
-    axs[1].plot(e0, color='black',linewidth=2)
-    axs[1].plot(e1, color='red', linestyle='dashed',linewidth=2)
-    axs[1].set_yticks([0,0.5,1])
-    axs[1].set_yticklabels([0.0,0.5,1.0],fontsize = 14)
-        
-    e0,e1 = audit_equality(y_true, y_pred, groups, window, step)
-    axs[2].plot(e0, color='black',linewidth=2)
-    axs[2].plot(e1, color='red', linestyle='dashed',linewidth=2)
-    axs[2].set_yticks([0,0.5,1])
-    axs[2].set_yticklabels([0.0,0.5,1.0],fontsize = 14)
-    axs[2].xaxis.set_tick_params(labelsize=14)
+    errors = {
+        'parity': audit_parity(y_pred, groups, window, step),
+        'calibration': audit_calibration(y_true, y_pred, groups, window, step),
+        'equality': audit_equality(y_true, y_pred, groups, window, step),
+    }
+    try:
+        with phase('plot_audit.draw'):
+            _draw_audit(axs, errors, title, label)
 
-    if(label):
-        axs[0].set_ylabel("Rpar", size=20)
-        axs[1].set_ylabel("Rcal", size=20)
-        axs[2].set_ylabel("Req", size=20)
-        axs[2].set_xlabel("Windows", size=20)
-    else:
-        axs[0].get_yaxis().set_ticks([])
-        axs[1].get_yaxis().set_ticks([])
-        axs[2].get_yaxis().set_ticks([])
-    
-    plt.savefig(filename, bbox_inches='tight')
-    
+        with phase('plot_audit.savefig'):
+            f.savefig(filename, bbox_inches='tight')
+    finally:
+        plt.close(f)
     return
 
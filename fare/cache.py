@@ -0,0 +1,185 @@
+"""Persistent on-disk cache for audit results.
+
+    Audits of the same ranking with the same arguments are answered from a
+    directory of result files keyed by a fingerprint of the inputs, which can
+    be shared by several worker processes.
+"""
+
+# License: BSD 3 clause
+
+import os
+import hashlib
+import tempfile
+import numpy as np
+from fare import audit
+
+__ALL__ = [
+    "fingerprint",
+    "AuditCache"
+]
+
+# bump whenever cached results of the same inputs could change
+ENGINE_VERSION = 1
+
+
+def fingerprint(*arrays, **params):
+    """Compute a content hash of audit inputs.
+
+    Parameters
+    ----------
+    *arrays : array-like or None
+        Input arrays, hashed by dtype, shape and contents.
+
+    **params :
+        Other arguments, hashed by their repr, or as arrays if they are
+        lists or arrays.
+
+    Returns
+    -------
+    key : str
+        Hexadecimal blake2b digest.
+
+    Examples
+    --------
+    >>> fingerprint([1,2,3], [0,1,0], window=2, step=1) == fingerprint([1,2,3], [0,1,0], step=1, window=2)
+    True
+    """
+    h = hashlib.blake2b(digest_size=20)
+    h.update(b"fare-%d" % ENGINE_VERSION)
+    for a in arrays:
+        if a is None:
+            h.update(b"none;")
+            continue
+        a = np.ascontiguousarray(a)
+        h.update(("%s%s;" % (a.dtype.str, a.shape)).encode())
+        h.update(a.view(np.uint8) if a.dtype != object else repr(a.tolist()).encode())
+    for name in sorted(params):
+        value = params[name]
+        if isinstance(value, np.generic):
+            value = value.item()
+        if isinstance(value, (list, tuple, np.ndarray)):
+            h.update(("%s=" % name).encode())
+            h.update(fingerprint(value).encode())
+        else:
+            h.update(("%s=%r;" % (name, value)).encode())
+    return h.hexdigest()
+
+
+class AuditCache(object):
+    """Bounded on-disk store of audit results.
+
+    Results are written to a temporary file and atomically renamed into the
+    cache directory, so concurrent readers and writers in other processes only
+    ever see complete entries. Reading an entry marks it as recently used, and
+    when the store grows beyond max_bytes the least recently used entries are
+    removed.
+
+    Parameters
+    ----------
+    directory : str
+        Directory holding the cached results. Created if missing.
+
+    max_bytes : int, optional
+        Size limit of the store.
+
+    Examples
+    --------
+    >>> cache = AuditCache('/tmp/fare-cache')
+    >>> cache.audit_parity([1,2,3,4], [0,1,0,1], 2, 1)
+    ([1.0, 0.0], [0.0, 1.0])
+    """
+
+    def __init__(self, directory, max_bytes=2**30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def get(self, key):
+        """Return the arrays stored under key, or None."""
+        path = self._path(key)
+        try:
+            with np.load(path) as f:
+                values = [f["arr_%d" % i] for i in range(len(f.files))]
+            #mark as recently used
+            os.utime(path)
+        except (OSError, ValueError):
+            #missing, evicted meanwhile or unreadable
+            return None
+        return values
+
+    def put(self, key, values):
+        """Store a list of arrays under key."""
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".tmp", suffix=".npz")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, *values)
+            os.replace(tmp, self._path(key))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".npz") or name.startswith(".tmp"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+        total = sum(e[1] for e in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        """Remove all cached results."""
+        for name in os.listdir(self.directory):
+            if name.endswith(".npz"):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+    def _cached(self, name, arrays, params, compute):
+        key = fingerprint(*arrays, function=name, **params)
+        values = self.get(key)
+        if values is None:
+            #return what a later hit reads back, whatever types compute returned
+            values = [np.asarray(r, dtype=float) for r in compute()]
+            self.put(key, values)
+        return tuple(list(v) for v in values)
+
+    def audit_parity(self, y, groups, window=None, step=None, bins=None):
+        """Cached audit_parity."""
+        return self._cached("audit_parity", [y, groups], dict(window=window, step=step, bins=bins),
+                            lambda: audit.audit_parity(y, groups, window, step, bins))
+
+    def audit_equality(self, y_true, y_pred, groups, window=None, step=None, bins=None):
+        """Cached audit_equality."""
+        return self._cached("audit_equality", [y_true, y_pred, groups],
+                            dict(window=window, step=step, bins=bins),
+                            lambda: audit.audit_equality(y_true, y_pred, groups, window, step, bins))
+
+    def audit_calibration(self, y_true, y_pred, groups, window=None, step=None, bins=None):
+        """Cached audit_calibration."""
+        return self._cached("audit_calibration", [y_true, y_pred, groups],
+                            dict(window=window, step=step, bins=bins),
+                            lambda: audit.audit_calibration(y_true, y_pred, groups, window, step, bins))
+
+    def generate_diagnostics(self, err0, err1):
+        """Cached generate_diagnostics."""
+        values = self._cached("generate_diagnostics", [err0, err1], {},
+                              lambda: [audit.generate_diagnostics(err0, err1)])
+        return list(values[0])
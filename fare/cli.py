@@ -0,0 +1,285 @@
+"""Command line batch auditor.
+
+    The fare-audit command reads a ranking from a CSV or Parquet file in
+    chunks, computes the rank parity, equality and calibration errors, their
+    audit error sequences and diagnostics for one or more group columns, and
+    writes the results as JSON or Parquet.
+"""
+
+# License: BSD 3 clause
+
+import argparse
+import csv
+import json
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from fare.metrics import _presort, _rank_parity_sorted, _rank_equality_sorted, _rank_calibration_sorted
+from fare.audit import audit_parity, audit_equality, audit_calibration, generate_diagnostics
+
+__ALL__ = [
+    "read_ranking",
+    "audit_ranking",
+    "main"
+]
+
+METRICS = ["parity", "equality", "calibration"]
+
+# rows converted to arrays at a time
+_CHUNK_ROWS = 65536
+
+
+class MemoryLimitError(ValueError):
+    """Raised when a ranking does not fit in the memory limit."""
+
+
+def _parse_groups(values, column):
+    values = np.asarray(values)
+    if values.dtype.kind in 'biuf':
+        g = values.astype(float)
+    else:
+        lower = np.char.lower(np.char.strip(values.astype(str)))
+        g = np.where(lower == 'true', 1., np.where(lower == 'false', 0., np.nan))
+        numeric = np.isnan(g)
+        if numeric.any():
+            try:
+                g[numeric] = lower[numeric].astype(float)
+            except ValueError:
+                raise ValueError("group column %r must hold 0/1 or true/false values" % column)
+    if not np.isin(g, [0, 1]).all():
+        raise ValueError("group column %r must hold 0/1 or true/false values" % column)
+    return g.astype(np.int8)
+
+
+def _csv_chunks(path, columns):
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        missing = [c for c in columns if c not in header]
+        if missing:
+            raise ValueError("columns %s not found in %s" % (missing, path))
+        idx = [header.index(c) for c in columns]
+        rows = []
+        for row in reader:
+            if len(row) < len(header):
+                raise ValueError("line %d of %s has %d fields, expected %d"
+                                 % (reader.line_num, path, len(row), len(header)))
+            rows.append([row[i] for i in idx])
+            if len(rows) == _CHUNK_ROWS:
+                yield [np.array(col) for col in zip(*rows)]
+                rows = []
+        if rows:
+            yield [np.array(col) for col in zip(*rows)]
+
+
+def _parquet_chunks(path, columns):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("reading Parquet files requires pyarrow")
+    f = pq.ParquetFile(path)
+    for batch in f.iter_batches(batch_size=_CHUNK_ROWS, columns=columns):
+        yield [batch.column(c).to_numpy(zero_copy_only=False) for c in columns]
+
+
+def read_ranking(path, y_pred, groups, y_true=None, max_memory=None):
+    """Read the columns of a ranking from a CSV or Parquet file in chunks.
+
+    Parameters
+    ----------
+    path : str
+        A .csv file with a header row, or a .parquet file.
+
+    y_pred : str
+        Name of the estimated target values column.
+
+    groups : list of str
+        Names of the binary group columns, holding 0/1 or true/false.
+
+    y_true : str, optional
+        Name of the ground truth target values column.
+
+    max_memory : int, optional
+        Maximum number of bytes for the loaded columns. Reading stops with a
+        MemoryLimitError once the ranking exceeds it.
+
+    Returns
+    -------
+    columns : dict
+        Arrays of the y_true (if given), y_pred and every group column, keyed
+        by column name.
+    """
+    names = ([] if y_true is None else [y_true]) + [y_pred] + list(groups)
+    chunks = _parquet_chunks if path.endswith('.parquet') else _csv_chunks
+    row_bytes = 8 * (len(names) - len(groups)) + len(groups)
+    parts = dict((name, []) for name in names)
+    n = 0
+    for chunk in chunks(path, names):
+        n += len(chunk[0])
+        if max_memory is not None and n * row_bytes > max_memory:
+            raise MemoryLimitError("ranking exceeds the memory limit of %d bytes after %d rows"
+                                   % (max_memory, n))
+        for name, values in zip(names, chunk):
+            if name in groups:
+                parts[name].append(_parse_groups(values, name))
+            else:
+                parts[name].append(np.asarray(values, dtype=float))
+    return dict((name, np.concatenate(p) if p else np.zeros(0)) for name, p in parts.items())
+
+
+def _number(x):
+    """Float for the output, None (null) for NaN, e.g. the trends of a single window."""
+    x = float(x)
+    return None if np.isnan(x) else x
+
+
+def _audit_metric(metric, y_true, y_pred, groups, window, step):
+    """Metric, audit sequences and diagnostics of one metric for one group column."""
+    if metric == 'parity':
+        g = np.asarray(groups, dtype=int)[np.asarray(y_pred).argsort()]
+        errors = _rank_parity_sorted(g)
+        err0, err1 = audit_parity(y_pred, groups, window, step)
+    elif metric == 'equality':
+        errors = _rank_equality_sorted(*_presort(y_true, y_pred, groups))
+        err0, err1 = audit_equality(y_true, y_pred, groups, window, step)
+    else:
+        errors = _rank_calibration_sorted(*_presort(y_true, y_pred, groups))
+        err0, err1 = audit_calibration(y_true, y_pred, groups, window, step)
+    trend0, trend1, dist = generate_diagnostics(err0, err1)
+    return {
+        "error0": _number(errors[0]),
+        "error1": _number(errors[1]),
+        "audit": {"error0": [_number(e) for e in err0], "error1": [_number(e) for e in err1]},
+        "diagnostics": {"trend0": _number(trend0), "trend1": _number(trend1), "distance": _number(dist)},
+    }
+
+
+def audit_ranking(columns, y_pred, groups, window, step, y_true=None, metrics=None, n_jobs=1):
+    """Compute the metrics, audits and diagnostics of a ranking for every group column.
+
+    Parameters
+    ----------
+    columns : dict
+        Arrays of the ranking keyed by column name, as returned by read_ranking.
+
+    y_pred : str
+        Name of the estimated target values column.
+
+    groups : list of str
+        Names of the binary group columns.
+
+    window : int
+        The number of instances in each audit window.
+
+    step : int
+        Step size for the sliding window.
+
+    y_true : str, optional
+        Name of the ground truth column, required for equality and calibration.
+
+    metrics : list of str, optional
+        Metrics to compute, by default all of 'parity', 'equality' and
+        'calibration'.
+
+    n_jobs : int, optional
+        Number of processes computing the (group column, metric) audits.
+
+    Returns
+    -------
+    results : dict
+        For every group column, a dict mapping every metric to its errors,
+        audit sequences and diagnostics. Undefined values, such as the trends
+        of an audit with a single window, are None.
+    """
+    metrics = METRICS if metrics is None else list(metrics)
+    if y_true is None and set(metrics) - set(['parity']):
+        raise ValueError("the equality and calibration metrics require a y_true column")
+    truth = None if y_true is None else columns[y_true]
+    keys = [(group, metric) for group in groups for metric in metrics]
+    tasks = [(metric, truth, columns[y_pred], columns[group], window, step) for group, metric in keys]
+    if n_jobs > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            outputs = list(pool.map(_audit_metric, *zip(*tasks)))
+    else:
+        outputs = [_audit_metric(*task) for task in tasks]
+    results = dict((group, {}) for group in groups)
+    for (group, metric), output in zip(keys, outputs):
+        results[group][metric] = output
+    return results
+
+
+def _write_parquet(results, path):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("writing Parquet files requires pyarrow")
+    rows = [(group, metric, r) for group, res in results.items() for metric, r in res.items()]
+    table = pa.table({
+        "group": [row[0] for row in rows],
+        "metric": [row[1] for row in rows],
+        "error0": [row[2]["error0"] for row in rows],
+        "error1": [row[2]["error1"] for row in rows],
+        "audit_error0": [row[2]["audit"]["error0"] for row in rows],
+        "audit_error1": [row[2]["audit"]["error1"] for row in rows],
+        "trend0": [row[2]["diagnostics"]["trend0"] for row in rows],
+        "trend1": [row[2]["diagnostics"]["trend1"] for row in rows],
+        "distance": [row[2]["diagnostics"]["distance"] for row in rows],
+    })
+    pq.write_table(table, path)
+
+
+def _parser():
+    parser = argparse.ArgumentParser(
+        prog="fare-audit",
+        description="Audit the fairness of a ranking with the FARE pairwise error metrics.")
+    parser.add_argument("input", help="ranking file, .csv with a header row or .parquet")
+    parser.add_argument("--y-pred", required=True, help="column of estimated target values")
+    parser.add_argument("--y-true", help="column of ground truth target values")
+    parser.add_argument("--group", action="append", required=True, dest="groups",
+                        help="binary group column, may be repeated")
+    parser.add_argument("--window", type=int, required=True, help="number of instances in each audit window")
+    parser.add_argument("--step", type=int, required=True, help="step size of the sliding window")
+    parser.add_argument("--metric", action="append", choices=METRICS, dest="metrics",
+                        help="metric to compute, may be repeated (default: all, or parity without --y-true)")
+    parser.add_argument("-o", "--output", default="-",
+                        help="output file, .json or .parquet (default: JSON to stdout)")
+    parser.add_argument("--jobs", type=int, default=1, help="number of processes")
+    parser.add_argument("--max-memory", type=float,
+                        help="memory limit for the loaded ranking, in megabytes")
+    return parser
+
+
+def main(argv=None):
+    """Run the fare-audit command."""
+    args = _parser().parse_args(argv)
+    metrics = args.metrics
+    if metrics is None:
+        metrics = METRICS if args.y_true else ["parity"]
+    max_memory = None if args.max_memory is None else int(args.max_memory * 2**20)
+    try:
+        columns = read_ranking(args.input, args.y_pred, args.groups, args.y_true, max_memory)
+        results = audit_ranking(columns, args.y_pred, args.groups, args.window, args.step,
+                                y_true=args.y_true, metrics=metrics, n_jobs=args.jobs)
+    except (ValueError, ImportError, OSError) as e:
+        sys.stderr.write("fare-audit: error: %s\n" % e)
+        return 1
+    output = {"input": args.input, "n_samples": len(columns[args.y_pred]),
+              "window": args.window, "step": args.step, "groups": results}
+    if args.output.endswith(".parquet"):
+        try:
+            _write_parquet(results, args.output)
+        except ImportError as e:
+            sys.stderr.write("fare-audit: error: %s\n" % e)
+            return 1
+    elif args.output == "-":
+        json.dump(output, sys.stdout, indent=2, allow_nan=False)
+        sys.stdout.write("\n")
+    else:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2, allow_nan=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
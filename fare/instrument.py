@@ -0,0 +1,151 @@
+"""Opt-in instrumentation of the metrics and audits.
+
+    The metrics and audits mark their phases (sorting, inversion counting,
+    window loops, plotting). While a profile is active, or a hook is
+    registered, every phase records its wall time, and counters such as the
+    number of audit windows, pairs examined and the largest array processed.
+    Otherwise marking a phase costs a single check.
+
+    Examples
+    --------
+    >>> from fare.instrument import profile
+    >>> with profile() as p:
+    ...     audit_equality(y_true, y_pred, groups, 100, 50)
+    >>> p.as_dict()['phases']['audit_equality.windows']['calls']
+    1
+"""
+
+# License: BSD 3 clause
+
+import time
+from contextlib import contextmanager
+
+__ALL__ = [
+    "profile",
+    "Profile",
+    "add_hook",
+    "remove_hook"
+]
+
+# active profiles and hooks, empty when instrumentation is off
+_profiles = []
+_hooks = []
+
+
+class _NullPhase(object):
+    """Phase marker used when instrumentation is off."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL = _NullPhase()
+
+
+class _Phase(object):
+    __slots__ = ("name", "size", "counters", "start")
+
+    def __init__(self, name, size, counters):
+        self.name = name
+        self.size = size
+        self.counters = counters
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        for p in list(_profiles):
+            p._record(self.name, elapsed, self.size, self.counters)
+        for hook in list(_hooks):
+            hook(self.name, elapsed, self.size, self.counters)
+        return False
+
+
+def phase(name, size=None, **counters):
+    """Mark a phase of the computation.
+
+    Parameters
+    ----------
+    name : str
+        Name of the phase.
+
+    size : int, optional
+        Size of the largest array processed in the phase.
+
+    **counters : int
+        Amounts to add to the named counters, e.g. windows or pairs.
+
+    Returns
+    -------
+    context : context manager
+        Times the phase if instrumentation is on.
+    """
+    if not (_profiles or _hooks):
+        return _NULL
+    return _Phase(name, size, counters)
+
+
+class Profile(object):
+    """Per-phase timings and counters collected by profile()."""
+
+    def __init__(self):
+        self.phases = {}
+        self.counters = {}
+
+    def _record(self, name, elapsed, size, counters):
+        stats = self.phases.get(name)
+        if stats is None:
+            stats = self.phases[name] = {"calls": 0, "time": 0., "peak_size": 0}
+        stats["calls"] += 1
+        stats["time"] += elapsed
+        if size is not None and size > stats["peak_size"]:
+            stats["peak_size"] = int(size)
+        for key, value in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def as_dict(self):
+        """Return the collected statistics.
+
+        Returns
+        -------
+        stats : dict
+            'phases' maps every phase name to its number of calls, total wall
+            time in seconds and largest array size, and 'counters' maps every
+            counter to its total.
+        """
+        return {"phases": dict((k, dict(v)) for k, v in self.phases.items()),
+                "counters": dict(self.counters)}
+
+
+@contextmanager
+def profile():
+    """Collect the phases run inside the context into a Profile.
+
+    Profiles may be nested, every active profile records all phases.
+    """
+    p = Profile()
+    _profiles.append(p)
+    try:
+        yield p
+    finally:
+        _profiles.remove(p)
+
+
+def add_hook(hook):
+    """Register a function called at the end of every phase.
+
+    The hook is called as hook(name, elapsed, size, counters), with the wall
+    time of the phase in seconds, its largest array size (or None) and a dict
+    of its counters, e.g. to forward phases to an external profiler.
+    """
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    """Unregister a hook added with add_hook."""
+    _hooks.remove(hook)
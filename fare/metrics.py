@@ -11,11 +11,18 @@
 # License: BSD 3 clause
 
 import numpy as np
+from fare.instrument import phase
 
 __ALL__ = [
     "rank_parity",
     "rank_equality",
-    "rank_calibration"
+    "rank_calibration",
+    "rank_parity_weighted",
+    "rank_equality_weighted",
+    "rank_calibration_weighted",
+    "dcg_discount",
+    "inversion_attribution",
+    "swap_sensitivity"
 ]
 
 
@@ -23,6 +30,181 @@ def _pairs(n):
     return n*(n-1)/2.
 
 
+def _dense_ranks(x):
+    """Return integer ranks of x (ties share a rank) and the number of distinct values."""
+    u, inv = np.unique(np.asarray(x), return_inverse=True)
+    return inv.ravel(), len(u)
+
+
+def _presort(y_true, y_pred, groups, return_order=False):
+    """Return the y_true ranks and groups of all items in y_pred order.
+
+    Items tied on y_pred are ordered by ascending y_true so that they never
+    form an inverted pair. With return_order, also return the sorting order.
+    """
+    y_true = np.asarray(y_true)
+    with phase('presort', size=len(y_true)):
+        order = np.lexsort((y_true, np.asarray(y_pred)))
+        t, m = _dense_ranks(y_true)
+    if return_order:
+        return t[order], np.asarray(groups, dtype=int)[order], m, order
+    return t[order], np.asarray(groups, dtype=int)[order], m
+
+
+# for short sequences comparing all pairs at once is cheaper than the merge levels
+_BRUTE_MAX = 256
+
+def _above_counts(t, g, m, below=False, weights=None):
+    """Count, for every item, the earlier items with a strictly larger t.
+
+    Parameters
+    ----------
+    t : array-like of shape = (n_samples)
+        Integer ranks in [0, m) of the true values, in predicted order.
+
+    g : array-like of shape = (n_samples)
+        Binary integer group labels, in predicted order.
+
+    m : int
+        Upper bound on the ranks in t.
+
+    below : boolean, optional
+        Also count the later items with a strictly smaller t, in the same pass.
+
+    weights : array-like of shape = (n_samples), optional
+        Weights of the items, in predicted order. When given, the weights of
+        the counted items are summed instead of counting them.
+
+    Returns
+    -------
+    above : array of shape = (n_samples, 2)
+        above[i, y] is the number of items in group y placed before item i
+        with a larger true value than item i.
+
+    below : array of shape = (n_samples, 2)
+        Only returned if below is True. below[i, y] is the number of items in
+        group y placed after item i with a smaller true value than item i.
+    """
+    n = len(t)
+    with phase('merge', size=n, pairs=n*(n-1)//2):
+        return _merge_counts(t, g, m, below, weights)
+
+
+def _merge_counts(t, g, m, below, weights):
+    """Implementation of _above_counts."""
+    n = len(t)
+    g = np.asarray(g)
+    w = None if weights is None else np.asarray(weights, dtype=float)
+    if n <= _BRUTE_MAX:
+        #inv[j, i] is True when j is placed before i with a larger value
+        inv = np.triu(t[:, None] > t[None, :], 1)
+        wg = np.column_stack([1 - g, g])
+        if w is not None:
+            wg = wg * w[:, None]
+        above = inv.T.dot(wg)
+        if not below:
+            return above
+        return above, inv.dot(wg)
+    dtype = np.int64 if w is None else float
+    above = np.zeros((n, 2), dtype=dtype)
+    smaller = np.zeros((n, 2), dtype=dtype) if below else None
+    pos = np.arange(n)
+    #bottom-up mergesort: st, sg, sw and idx hold the ranks, group 1 weights,
+    #weights and positions of the items sorted within each block of size s
+    st, idx = np.asarray(t, dtype=np.int64), pos
+    sg = g if w is None else g * w
+    sw = w
+    def cumulative(x):
+        return np.concatenate(([0], np.cumsum(x)))
+    s = 1
+    while s < n:
+        blk = pos // (2*s)
+        left = (pos // s) % 2 == 0
+        right = ~left
+        lblk, rblk = blk[left], blk[right]
+        #keys are sorted since blocks are sorted and in order
+        lkey = lblk * m + st[left]
+        rkey = rblk * m + st[right]
+        lones = cumulative(sg[left])
+        #count the larger items in the left sibling of every right item
+        lo = np.searchsorted(lkey, rkey, side='right')
+        hi = (rblk + 1) * s
+        ones = lones[hi] - lones[lo]
+        total = hi - lo
+        if sw is not None:
+            lall = cumulative(sw[left])
+            total = lall[hi] - lall[lo]
+        ridx = idx[right]
+        above[ridx, 1] += ones
+        above[ridx, 0] += total - ones
+        #merge siblings by moving each item past the smaller items of its sibling
+        dest = np.empty(n, dtype=np.int64)
+        dest[right] = pos[right] - s + lo - rblk * s
+        lo = np.searchsorted(rkey, lkey, side='left')
+        dest[left] = pos[left] + lo - lblk * s
+        if below:
+            #the smaller items in the right sibling of every left item
+            first = lblk * s
+            rones = cumulative(sg[right])
+            ones = rones[lo] - rones[first]
+            total = lo - first
+            if sw is not None:
+                rall = cumulative(sw[right])
+                total = rall[lo] - rall[first]
+            lidx = idx[left]
+            smaller[lidx, 1] += ones
+            smaller[lidx, 0] += total - ones
+        st2, sg2, idx2 = np.empty_like(st), np.empty_like(sg), np.empty_like(idx)
+        st2[dest], sg2[dest], idx2[dest] = st, sg, idx
+        st, sg, idx = st2, sg2, idx2
+        if sw is not None:
+            sw2 = np.empty_like(sw)
+            sw2[dest] = sw
+            sw = sw2
+        s *= 2
+    if below:
+        return above, smaller
+    return above
+
+
+def _inversion_matrix(t, g, m):
+    """Count inverted pairs by group.
+
+    Returns a 2x2 array c where c[x, y] is the number of inverted pairs whose
+    later placed item is in group x and whose earlier placed item is in group y.
+    """
+    above = _above_counts(t, g, m)
+    c = np.zeros((2, 2), dtype=np.int64)
+    c[0] = above[g == 0].sum(axis=0)
+    c[1] = above[g == 1].sum(axis=0)
+    return c
+
+
+
+# labels with at most this many distinct values use the graded counting
+_GRADED_MAX_LEVELS = 16
+
+def _graded_inversion_matrix(t, g, m):
+    """Count inverted pairs by group for few distinct true values.
+
+    Same result as _inversion_matrix, computed from running counts of the items
+    above each level in O(n*m) instead of merging.
+    """
+    c = np.zeros((2, 2), dtype=np.int64)
+    with phase('graded', size=len(t), pairs=len(t)*(len(t)-1)//2):
+        for level in range(m - 1):
+            at = t == level
+            if not at.any():
+                continue
+            higher = t > level
+            for y in range(2):
+                #earlier items of group y with a higher level, at every item of this level
+                above = np.cumsum(higher & (g == y))[at]
+                ones = above.dot(g[at])
+                c[1, y] += ones
+                c[0, y] += above.sum() - ones
+    return c
+
 
 #calibration
 def _merge_cal(h1,h2,g):
@@ -112,7 +294,96 @@ def _count_inversions(data, s, e, merge_fnc, g):
         return merged, (c1+c2+c)
 
 
-def rank_equality(y_true, y_pred, groups):
+def _segment_inversions(t, g, m, seg, nseg):
+    """Count inverted pairs by group within each contiguous segment.
+
+    seg holds the non-decreasing segment id of every item. Returns an array c of
+    shape (nseg, 2, 2) with the counts of _inversion_matrix for every segment.
+    """
+    #offset ranks by segment so that pairs across segments are never inverted
+    above = _above_counts(seg * m + t, g, nseg * m)
+    c = np.zeros((nseg, 2, 2), dtype=np.int64)
+    for x in range(2):
+        for y in range(2):
+            c[:, x, y] = np.bincount(seg, weights=above[:, y] * (g == x), minlength=nseg)
+    return c
+
+
+#vectorized errors from pair counts and group sizes
+def _parity_errors(p01, n0, n1):
+    p = n0 * n1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        e0 = np.where(n1 == 0, 1., np.where(n0 == 0, 0., p01 / p))
+        e1 = np.where(n1 == 0, 0., np.where(n0 == 0, 1., (p - p01) / p))
+    return e0, e1
+
+
+def _equality_errors(c, n0, n1):
+    p = n0 * n1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        e0 = np.where(p == 0, 0., c[..., 0, 1] / p)
+        e1 = np.where(p == 0, 0., c[..., 1, 0] / p)
+    return e0, e1
+
+
+def _calibration_errors(c, n0, n1):
+    p0 = _pairs(n0 + n1) - _pairs(n1)
+    p1 = _pairs(n0 + n1) - _pairs(n0)
+    mixed = c[..., 0, 1] + c[..., 1, 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        e0 = np.where(p0 == 0, 0., (mixed + c[..., 0, 0]) / p0)
+        e1 = np.where(p1 == 0, 0., (mixed + c[..., 1, 1]) / p1)
+    return e0, e1
+
+
+#fast paths for data already sorted by predicted value
+def _rank_parity_sorted(g):
+    """Rank parity of a binary group sequence given in rank order."""
+    n1 = np.count_nonzero(g)
+    n0 = len(g) - n1
+    if(n1 == 0):
+        return 1.,0.
+    if(n0 == 0):
+        return 0.,1.
+    p = np.int64(n0)*n1
+    # pairs with a group 0 item placed before a group 1 item
+    p01 = np.cumsum(g == 0)[g == 1].sum()
+    return p01 / p, (p - p01) / p
+
+
+def _rank_equality_sorted(t, g, m, graded=False):
+    """Rank equality of y_true ranks t and groups g given in y_pred order."""
+    n1 = np.count_nonzero(g)
+    p = (len(g) - n1)*n1
+    if p == 0:
+        return 0, 0
+    c = (_graded_inversion_matrix if graded else _inversion_matrix)(t, g, m)
+    return c[0, 1] / p, c[1, 0] / p
+
+
+def _rank_calibration_sorted(t, g, m, graded=False):
+    """Rank calibration of y_true ranks t and groups g given in y_pred order."""
+    n1 = np.count_nonzero(g)
+    p0 = _pairs(len(g)) - _pairs(n1)
+    p1 = _pairs(len(g)) - _pairs(len(g) - n1)
+    count = _graded_inversion_matrix if graded else _inversion_matrix
+    c = count(t, g, m) if (p0 or p1) else np.zeros((2, 2), dtype=np.int64)
+    mixed = c[0, 1] + c[1, 0]
+    e0 = 0 if p0 == 0 else (mixed + c[0, 0]) / p0
+    e1 = 0 if p1 == 0 else (mixed + c[1, 1]) / p1
+    return e0, e1
+
+
+def _use_graded(y_true, method):
+    """Whether to count inversions per label level."""
+    if method not in ('auto', 'graded', 'merge'):
+        raise ValueError("method must be 'auto', 'graded' or 'merge', got %r" % method)
+    if method == 'auto':
+        return len(np.unique(np.asarray(y_true))) <= _GRADED_MAX_LEVELS
+    return method == 'graded'
+
+
+def rank_equality(y_true, y_pred, groups, method='auto'):
     """Compute the rank equality error between two rankings.
 
     Parameters
@@ -126,6 +397,13 @@ def rank_equality(y_true, y_pred, groups):
     groups : array-like of shape = (n_samples)
         Binary integer array with group labels for each sample. 
 
+    method : str, optional
+        'merge' counts inverted pairs by mergesort. 'graded' counts them from
+        running counts per label level in O(n*levels), for graded relevance
+        labels. 'auto' uses 'graded' when y_true has at most 16 distinct
+        values. With every method, items with equal y_true (or equal y_pred)
+        never form an inverted pair.
+
     Returns
     ----------
     error0 : float
@@ -142,18 +420,12 @@ def rank_equality(y_true, y_pred, groups):
     >>> rank_equality(y_true,y_pred,groups)
     (0.0, 0.25)
     """
-    #sort instances by y_pred
-    r = np.transpose([y_true,y_pred,groups])
-    r = r[r[:,0].argsort()]
-    #count the items in each group for narmalization
-    len_groups = np.bincount(np.array(groups, dtype=int), minlength=2)
-    p = len_groups[0]*len_groups[1]
-    e0 = 0 if p == 0 else _count_inversions(r, 0, len(r)-1, _merge_eq, 0)[1] / p
-    e1 = 0 if p == 0 else _count_inversions(r, 0, len(r)-1, _merge_eq, 1)[1] / p
-    return e0, e1
+    #sort true value ranks and groups by predicted value, ties by true value
+    t, g, m = _presort(y_true, y_pred, groups)
+    return _rank_equality_sorted(t, g, m, graded=_use_graded(y_true, method))
 
 
-def rank_calibration(y_true, y_pred, groups):
+def rank_calibration(y_true, y_pred, groups, method='auto'):
     """Compute the rank calibration error between two rankings.
 
     Parameters
@@ -167,6 +439,13 @@ def rank_calibration(y_true, y_pred, groups):
     groups : array-like of shape = (n_samples)
         Binary integer array with group labels for each sample. 
 
+    method : str, optional
+        'merge' counts inverted pairs by mergesort. 'graded' counts them from
+        running counts per label level in O(n*levels), for graded relevance
+        labels. 'auto' uses 'graded' when y_true has at most 16 distinct
+        values. With every method, items with equal y_true (or equal y_pred)
+        never form an inverted pair.
+
     Returns
     -------
     error0 : float
@@ -183,17 +462,9 @@ def rank_calibration(y_true, y_pred, groups):
     >>> rank_calibration(y_true,y_pred,groups)
     (0.20000000000000001, 0.40000000000000002)
     """
-    #sort instances by y_pred
-    r = np.transpose([y_true,y_pred,groups])
-    r = r[r[:,0].argsort()]
-    #count the items in each group for normalization
-    len_groups = np.bincount(np.array(groups, dtype=int), minlength=2)
-    p0 = _pairs(len(r)) - _pairs(len_groups[1])
-    p1 = _pairs(len(r)) - _pairs(len_groups[0])
-    # count pairs
-    e0 = 0 if p0 == 0 else _count_inversions(r, 0, len(r)-1, _merge_cal, 0)[1] / p0
-    e1 = 0 if p1 == 0 else _count_inversions(r, 0, len(r)-1, _merge_cal, 1)[1] / p1
-    return e0, e1 
+    #sort true value ranks and groups by predicted value, ties by true value
+    t, g, m = _presort(y_true, y_pred, groups)
+    return _rank_calibration_sorted(t, g, m, graded=_use_graded(y_true, method))
 
 def rank_parity(y,groups):
     """Compute the rank parity error for one ranking.
@@ -235,7 +506,358 @@ def rank_parity(y,groups):
         return 0.,1.
     p = len_groups[0]*len_groups[1]
     # if there are no mixed pairs, can't normalize so set both errs = 0
-    e0 = _count_inversions(g, 0, len(g)-1, _merge_parity, 0)[1] / p
-    e1 = _count_inversions(g, 0, len(g)-1, _merge_parity, 1)[1] / p
+    with phase('count_inversions', size=len(g), pairs=2*int(_pairs(len(g)))):
+        e0 = _count_inversions(g, 0, len(g)-1, _merge_parity, 0)[1] / p
+        e1 = _count_inversions(g, 0, len(g)-1, _merge_parity, 1)[1] / p
 
     return e0,e1
+
+
+def dcg_discount(positions):
+    """DCG-style logarithmic discount of ranking positions.
+
+    Position 0 holds the item with the smallest y_pred, which is the top of the
+    ranking when y_pred holds rank positions as in the FA*IR examples. Pass it
+    as the weights of the weighted metrics to emphasize errors at the top.
+
+    Parameters
+    ----------
+    positions : array-like of int
+        Zero-based positions in the ranking.
+
+    Returns
+    -------
+    weights : array
+        1 / log2(position + 2) for every position.
+    """
+    return 1. / np.log2(np.asarray(positions) + 2)
+
+
+def _position_weights(weights, n):
+    """Return the weight of every position of a ranking of n items."""
+    if weights is None:
+        return np.ones(n)
+    if callable(weights):
+        weights = weights(np.arange(n))
+    weights = np.asarray(weights, dtype=float)
+    if weights.shape != (n,):
+        raise ValueError("expected %d position weights, got shape %s" % (n, weights.shape))
+    return weights
+
+
+def _weighted_pair_counts(t, g, m, w, pair_weight):
+    """Sum pair weights by group.
+
+    Returns 2x2 arrays c and total: c[x, y] sums the weights of the inverted
+    pairs and total[x, y] the weights of all pairs whose later placed item is
+    in group x and whose earlier placed item is in group y. With t None only
+    total is computed.
+    """
+    if pair_weight not in ('top', 'product'):
+        raise ValueError("pair_weight must be 'top' or 'product', got %r" % pair_weight)
+    #a pair weighs the weight of its earlier position, times the later one for product
+    later = np.ones(len(g)) if pair_weight == 'top' else w
+    before = np.zeros((len(g), 2))
+    before[1:, 0] = np.cumsum(w * (1 - g))[:-1]
+    before[1:, 1] = np.cumsum(w * g)[:-1]
+    c = np.zeros((2, 2))
+    total = np.zeros((2, 2))
+    above = None if t is None else _above_counts(t, g, m, weights=w)
+    for x in range(2):
+        total[x] = later[g == x].dot(before[g == x])
+        if above is not None:
+            c[x] = later[g == x].dot(above[g == x])
+    return c, total
+
+
+def rank_parity_weighted(y, groups, weights=None, pair_weight='top'):
+    """Compute the rank parity error for one ranking with position weights.
+
+    Every mixed pair counts with a weight given by its positions in the
+    ranking instead of counting equally, e.g. to emphasize the top of the
+    ranking with dcg_discount. Without weights the result equals rank_parity.
+
+    Parameters
+    ----------
+    y : array-like of shape = (n_samples)
+        Rank values.
+
+    groups : array-like of shape = (n_samples)
+        Binary integer array with group labels for each sample.
+
+    weights : array-like of shape = (n_samples) or callable, optional
+        Weight of every position of the ranking sorted by ascending y, or a
+        function mapping an array of positions to their weights.
+
+    pair_weight : str, optional
+        'top' weighs a pair by the weight of its earlier position, 'product'
+        by the product of the weights of both positions.
+
+    Returns
+    -------
+    error0 : float
+        The weighted rank parity error for group 0.
+
+    error1 : float
+        The weighted rank parity error for group 1.
+
+    Examples
+    --------
+    >>> y = [1,3,4,2]
+    >>> groups =[0,1,0,1]
+    >>> rank_parity_weighted(y, groups, dcg_discount)
+    (0.6387878864795979, 0.36121211352040195)
+    """
+    g = np.asarray(groups, dtype=int)[np.asarray(y).argsort()]
+    n1 = np.count_nonzero(g)
+    if(n1 == 0):
+        return 1.,0.
+    if(n1 == len(g)):
+        return 0.,1.
+    _, total = _weighted_pair_counts(None, g, None, _position_weights(weights, len(g)), pair_weight)
+    p = total[0, 1] + total[1, 0]
+    return total[1, 0] / p, total[0, 1] / p
+
+
+def rank_equality_weighted(y_true, y_pred, groups, weights=None, pair_weight='top'):
+    """Compute the rank equality error between two rankings with position weights.
+
+    Every pair counts with a weight given by its positions in the ranking by
+    y_pred instead of counting equally, e.g. to emphasize the top of the
+    ranking with dcg_discount. The errors are normalized by the total weight of
+    the mixed pairs. Weighted sums are computed in the same mergesort pass as
+    the unweighted counts, and without weights the result equals rank_equality.
+
+    Parameters
+    ----------
+    y_true : array-like of shape = (n_samples)
+        Ground truth (correct) target values.
+
+    y_pred : array-like of shape = (n_samples)
+        Estimated target values.
+
+    groups : array-like of shape = (n_samples)
+        Binary integer array with group labels for each sample.
+
+    weights : array-like of shape = (n_samples) or callable, optional
+        Weight of every position of the ranking sorted by ascending y_pred, or
+        a function mapping an array of positions to their weights.
+
+    pair_weight : str, optional
+        'top' weighs a pair by the weight of its earlier position, 'product'
+        by the product of the weights of both positions.
+
+    Returns
+    -------
+    error0 : float
+        The weighted rank equality error for group 0.
+
+    error1 : float
+        The weighted rank equality error for group 1.
+
+    Examples
+    --------
+    >>> y_true = [1,2,3,4]
+    >>> y_pred = [1,3,4,2]
+    >>> groups =[0,1,0,1]
+    >>> rank_equality_weighted(y_true, y_pred, groups, dcg_discount)
+    (0.20151514190050246, 0.0)
+    """
+    t, g, m = _presort(y_true, y_pred, groups)
+    c, total = _weighted_pair_counts(t, g, m, _position_weights(weights, len(g)), pair_weight)
+    p = total[0, 1] + total[1, 0]
+    if p == 0:
+        return 0, 0
+    return c[0, 1] / p, c[1, 0] / p
+
+
+def rank_calibration_weighted(y_true, y_pred, groups, weights=None, pair_weight='top'):
+    """Compute the rank calibration error between two rankings with position weights.
+
+    Every pair counts with a weight given by its positions in the ranking by
+    y_pred instead of counting equally, e.g. to emphasize the top of the
+    ranking with dcg_discount. The error of each group is normalized by the
+    total weight of the pairs containing the group. Without weights the result
+    equals rank_calibration.
+
+    Parameters
+    ----------
+    y_true : array-like of shape = (n_samples)
+        Ground truth (correct) target values.
+
+    y_pred : array-like of shape = (n_samples)
+        Estimated target values.
+
+    groups : array-like of shape = (n_samples)
+        Binary integer array with group labels for each sample.
+
+    weights : array-like of shape = (n_samples) or callable, optional
+        Weight of every position of the ranking sorted by ascending y_pred, or
+        a function mapping an array of positions to their weights.
+
+    pair_weight : str, optional
+        'top' weighs a pair by the weight of its earlier position, 'product'
+        by the product of the weights of both positions.
+
+    Returns
+    -------
+    error0 : float
+        The weighted rank calibration error for group 0.
+
+    error1 : float
+        The weighted rank calibration error for group 1.
+
+    Examples
+    --------
+    >>> y_true = [1,2,3,4]
+    >>> y_pred = [1,3,4,2]
+    >>> groups =[0,1,0,1]
+    >>> rank_calibration_weighted(y_true, y_pred, groups, dcg_discount)
+    (0.15273311123869335, 0.3354350434265104)
+    """
+    t, g, m = _presort(y_true, y_pred, groups)
+    c, total = _weighted_pair_counts(t, g, m, _position_weights(weights, len(g)), pair_weight)
+    mixed = c[0, 1] + c[1, 0]
+    p_mixed = total[0, 1] + total[1, 0]
+    p0 = p_mixed + total[0, 0]
+    p1 = p_mixed + total[1, 1]
+    e0 = 0 if p0 == 0 else (mixed + c[0, 0]) / p0
+    e1 = 0 if p1 == 0 else (mixed + c[1, 1]) / p1
+    return e0, e1
+
+
+def inversion_attribution(y_true, y_pred, groups):
+    """Attribute the inverted cross-group pairs of a ranking to its items.
+
+    A pair of items from different groups is inverted when the item with the
+    higher y_pred has the lower y_true. The pair favors the group of the item
+    with the higher y_pred, as counted by the rank equality error of that
+    group. Summing favored over the items of group g and dividing by
+    n0*n1 gives the rank equality error of group g. The counts come out of
+    the same mergesort pass used by the metrics, in O(n log n).
+
+    Parameters
+    ----------
+    y_true : array-like of shape = (n_samples)
+        Ground truth (correct) target values.
+
+    y_pred : array-like of shape = (n_samples)
+        Estimated target values.
+
+    groups : array-like of shape = (n_samples)
+        Binary integer array with group labels for each sample.
+
+    Returns
+    -------
+    favored : array of shape = (n_samples)
+        The number of inverted pairs in which each item is placed above an
+        item of the other group with a higher true value.
+
+    disfavored : array of shape = (n_samples)
+        The number of inverted pairs in which each item is placed below an
+        item of the other group with a lower true value.
+
+    Examples
+    --------
+    >>> y_true = [1,2,3,4]
+    >>> y_pred = [1,3,4,2]
+    >>> groups =[0,1,0,1]
+    >>> inversion_attribution(y_true,y_pred,groups)
+    (array([0, 0, 1, 0]), array([0, 0, 0, 1]))
+    """
+    t, g, m, order = _presort(y_true, y_pred, groups, return_order=True)
+    above, below = _above_counts(t, g, m, below=True)
+    other = 1 - g
+    favored = np.empty(len(g), dtype=np.int64)
+    disfavored = np.empty(len(g), dtype=np.int64)
+    #items later in y_pred order are placed higher
+    favored[order] = above[np.arange(len(g)), other]
+    disfavored[order] = below[np.arange(len(g)), other]
+    return favored, disfavored
+
+
+def swap_sensitivity(y_true, y_pred, groups, metric='equality', return_order=False):
+    """Change of the errors of a metric for every swap of two adjacent items.
+
+    Swapping the items at positions i and i+1 of the ranking only changes
+    whether that one pair is inverted, so the change of each error is zero or
+    plus or minus one over its normalization term. All n-1 changes are
+    computed at once after sorting the ranking, in linear time.
+
+    Parameters
+    ----------
+    y_true : array-like of shape = (n_samples)
+        Ground truth (correct) target values. Ignored for the parity metric.
+
+    y_pred : array-like of shape = (n_samples)
+        Estimated target values.
+
+    groups : array-like of shape = (n_samples)
+        Binary integer array with group labels for each sample.
+
+    metric : str, optional
+        One of 'parity', 'equality' or 'calibration'.
+
+    return_order : boolean, optional
+        Also return the indices of the items in ranking order.
+
+    Returns
+    -------
+    delta0 : array of shape = (n_samples - 1)
+        delta0[i] is the change of the error for group 0 when the items at
+        positions i and i+1 of the ranking are swapped. The ranking sorts the
+        items by increasing y_pred, ties by increasing y_true, as in the
+        metrics.
+
+    delta1 : array of shape = (n_samples - 1)
+        The change of the error for group 1.
+
+    order : array of shape = (n_samples)
+        Only returned if return_order is True. The index of the item at every
+        position of the ranking.
+
+    Examples
+    --------
+    >>> y_true = [1,2,3,4]
+    >>> y_pred = [1,3,4,2]
+    >>> groups =[0,1,0,1]
+    >>> swap_sensitivity(y_true,y_pred,groups)
+    (array([0.25, 0.  , 0.  ]), array([0.  , 0.  , 0.25]))
+    """
+    if metric == 'parity':
+        order = np.argsort(np.asarray(y_pred), kind='mergesort')
+        g = np.asarray(groups, dtype=int)[order]
+        n1 = np.count_nonzero(g)
+        p = (len(g) - n1) * n1
+        #swapping a group 0 item placed before a group 1 item removes one such pair
+        d = g[:-1] - g[1:]
+        delta = d / p if p else np.zeros(len(d))
+        result = (delta, -delta)
+    elif metric in ('equality', 'calibration'):
+        t, g, m, order = _presort(y_true, y_pred, groups, return_order=True)
+        n1 = np.count_nonzero(g)
+        n0 = len(g) - n1
+        #+1 if the swap inverts the pair, -1 if it was inverted
+        d = np.sign(t[1:] - t[:-1])
+        first, second = g[:-1], g[1:]
+        if metric == 'equality':
+            p = n0 * n1
+            if p == 0:
+                result = (np.zeros(len(d)), np.zeros(len(d)))
+            else:
+                #a new inversion places the first item later, an old one had the second item later
+                later = np.where(d > 0, first, second)
+                mixed = d * (first != second)
+                result = (mixed * (later == 0) / p, mixed * (later == 1) / p)
+        else:
+            p0 = _pairs(len(g)) - _pairs(n1)
+            p1 = _pairs(len(g)) - _pairs(n0)
+            e0 = d * ((first == 0) | (second == 0))
+            e1 = d * ((first == 1) | (second == 1))
+            result = (e0 / p0 if p0 else np.zeros(len(d)), e1 / p1 if p1 else np.zeros(len(d)))
+    else:
+        raise ValueError("metric must be 'parity', 'equality' or 'calibration', got %r" % metric)
+    result = tuple(np.asarray(r, dtype=float) for r in result)
+    if return_order:
+        return result + (order,)
+    return result
@@ -0,0 +1,228 @@
+"""Asyncio interface for computing the metrics of many small rankings.
+
+    Requests made concurrently from an event loop are coalesced into
+    micro-batches, and every batch is computed with the segmented counting
+    kernels on a worker pool, so the event loop is never blocked.
+"""
+
+# License: BSD 3 clause
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from fare.metrics import _dense_ranks, _segment_inversions, _equality_errors, _calibration_errors
+from fare.audit import _audit_parity_segments
+
+__ALL__ = [
+    "AsyncAuditor"
+]
+
+
+def _check(metric, args):
+    """Validate one request, returning its arrays."""
+    if metric not in ('parity', 'equality', 'calibration'):
+        raise ValueError("unknown metric %r" % metric)
+    arrays = [np.asarray(a) for a in args]
+    if any(a.ndim != 1 or len(a) != len(arrays[0]) for a in arrays):
+        raise ValueError("the rankings of a %s request must be 1-d arrays of the same length" % metric)
+    return arrays
+
+
+def _evaluate_batch(requests):
+    """Compute a batch of (metric, args) requests.
+
+    Returns one (error0, error1) pair, or the exception raised by the request,
+    per request. Rankings of the same metric are concatenated into segments,
+    sorted together and counted in a single pass.
+    """
+    results = [None] * len(requests)
+    batches = {}
+    for i, (metric, args) in enumerate(requests):
+        try:
+            batches.setdefault(metric, []).append((i, _check(metric, args)))
+        except Exception as e:
+            results[i] = e
+    for metric, items in batches.items():
+        lengths = np.array([len(arrays[0]) for _, arrays in items])
+        seg = np.repeat(np.arange(len(items)), lengths)
+        columns = [np.concatenate(c) for c in zip(*[arrays for _, arrays in items])]
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        if metric == 'parity':
+            y, groups = columns
+            g = groups.astype(int)[np.lexsort((y, seg))]
+            e0, e1 = _audit_parity_segments(g, offsets[:-1], offsets[1:])
+        else:
+            #sort every segment by y_pred, ties by y_true as in _presort
+            y_true, y_pred, groups = columns
+            order = np.lexsort((y_true, y_pred, seg))
+            t, m = _dense_ranks(y_true)
+            t, g = t[order], groups.astype(int)[order]
+            c = _segment_inversions(t, g, m, seg, len(items))
+            n1 = np.bincount(seg, weights=g, minlength=len(items)).astype(np.int64)
+            errors = _equality_errors if metric == 'equality' else _calibration_errors
+            e0, e1 = errors(c, lengths - n1, n1)
+        for (i, _), a, b in zip(items, e0, e1):
+            results[i] = (a, b)
+    return results
+
+
+class AsyncAuditor(object):
+    """Compute rank parity, equality and calibration errors from asyncio code.
+
+    Concurrent requests are queued and grouped into batches of at most
+    max_batch requests, waiting at most max_delay seconds for a batch to fill.
+    Every batch runs on the executor, and the awaiting coroutines receive
+    their results as soon as it completes. Results match the metrics of
+    fare.metrics, which never invert pairs tied on y_true or y_pred. Only
+    rank_parity may differ on rankings with tied values: the service orders
+    tied items stably, while fare.metrics.rank_parity leaves their order to
+    an unstable sort.
+
+    Parameters
+    ----------
+    max_batch : int, optional
+        Maximum number of requests computed together.
+
+    max_delay : float, optional
+        Maximum time in seconds a request waits for its batch to fill.
+
+    executor : concurrent.futures.Executor, optional
+        Worker pool running the batches. By default a thread pool of
+        n_workers threads owned by the auditor.
+
+    n_workers : int, optional
+        Number of threads of the default executor.
+
+    Examples
+    --------
+    >>> async def main():
+    ...     async with AsyncAuditor() as auditor:
+    ...         return await auditor.rank_equality([1,2,3,4], [1,3,4,2], [0,1,0,1])
+    >>> asyncio.run(main())
+    (0.25, 0.0)
+    """
+
+    def __init__(self, max_batch=256, max_delay=0.002, executor=None, n_workers=1):
+        if max_batch < 1:
+            raise ValueError("max_batch must be positive")
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._executor = executor
+        self._own_executor = executor is None
+        self._n_workers = n_workers
+        self._queue = None
+        self._task = None
+        self._pending = set()
+        self._closing = False
+        #number of requests and batches computed
+        self.stats = {"requests": 0, "batches": 0}
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+        return False
+
+    def start(self):
+        """Start collecting requests on the running event loop."""
+        if self._task is not None:
+            return
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._n_workers)
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._collect())
+
+    async def close(self):
+        """Compute the queued requests and stop.
+
+        Requests made while closing raise a RuntimeError. Requests made after
+        close returns start the auditor again.
+        """
+        if self._task is None or self._closing:
+            return
+        #requests made while closing are rejected instead of queued behind the end
+        self._closing = True
+        try:
+            await self._queue.put(None)
+            await self._task
+        finally:
+            self._task = None
+            self._closing = False
+            if self._own_executor:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+    async def rank_parity(self, y, groups):
+        """Rank parity error, see fare.metrics.rank_parity."""
+        return await self._submit('parity', (y, groups))
+
+    async def rank_equality(self, y_true, y_pred, groups):
+        """Rank equality error, see fare.metrics.rank_equality."""
+        return await self._submit('equality', (y_true, y_pred, groups))
+
+    async def rank_calibration(self, y_true, y_pred, groups):
+        """Rank calibration error, see fare.metrics.rank_calibration."""
+        return await self._submit('calibration', (y_true, y_pred, groups))
+
+    async def _submit(self, metric, args):
+        if self._closing:
+            raise RuntimeError("AsyncAuditor is closing")
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((metric, args, future))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        closing = False
+        while not closing:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is None:
+                    closing = True
+                    break
+                batch.append(item)
+            #compute the batch while the next one is collected
+            task = loop.create_task(self._run(batch))
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+        if self._pending:
+            await asyncio.gather(*self._pending)
+        #fail requests queued after the end
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None and not item[2].done():
+                item[2].set_exception(RuntimeError("AsyncAuditor is closed"))
+
+    async def _run(self, batch):
+        loop = asyncio.get_running_loop()
+        requests = [(metric, args) for metric, args, _ in batch]
+        try:
+            results = await loop.run_in_executor(self._executor, _evaluate_batch, requests)
+        except Exception as e:
+            results = [e] * len(batch)
+        self.stats["requests"] += len(batch)
+        self.stats["batches"] += 1
+        for (_, _, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
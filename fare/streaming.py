@@ -0,0 +1,351 @@
+"""Streaming estimates of the pairwise error metrics.
+
+    For rankings that keep growing, e.g. feeds of scored items, the metrics
+    are estimated from mergeable quantile sketches of the predicted values of
+    every group instead of storing every item.
+"""
+
+# License: BSD 3 clause
+
+import numpy as np
+from fare.metrics import _GRADED_MAX_LEVELS
+
+__ALL__ = [
+    "QuantileSketch",
+    "StreamingAuditor"
+]
+
+# rescale the stored weights once the decay scale falls below this
+_MIN_SCALE = 1e-100
+
+
+class QuantileSketch(object):
+    """Mergeable KLL-style sketch of a stream of weighted values.
+
+    The values are kept in levels of compactors. When a level exceeds its
+    capacity, its values are sorted, paired, and one value of every pair is
+    promoted to the next level with the weight of both, chosen with
+    probability proportional to its weight. The estimated rank of any value
+    is unbiased, and its error is a small multiple of total_weight / k with
+    high probability, while at most about 3k values are stored.
+
+    Parameters
+    ----------
+    k : int, optional
+        Capacity of the top level, trading memory for accuracy.
+
+    seed : int, optional
+        Seed of the random compactions.
+
+    Examples
+    --------
+    >>> sketch = QuantileSketch(seed=0)
+    >>> sketch.update(np.arange(100))
+    >>> sketch.rank(49.5)
+    0.5
+    """
+
+    def __init__(self, k=200, seed=None):
+        if k < 2:
+            raise ValueError("k must be at least 2")
+        self.k = k
+        self._rng = np.random.RandomState(seed)
+        #values and stored weights of every level, the weight of an item is
+        #its stored weight times the decay scale
+        self._values = []
+        self._weights = []
+        self._scale = 1.
+
+    def _capacity(self, h):
+        return max(2, int(np.ceil(self.k * (2. / 3) ** (len(self._values) - 1 - h))))
+
+    def _add(self, h, values, weights):
+        while len(self._values) <= h:
+            self._values.append(np.zeros(0))
+            self._weights.append(np.zeros(0))
+        self._values[h] = np.concatenate((self._values[h], values))
+        self._weights[h] = np.concatenate((self._weights[h], weights))
+
+    def _compress(self):
+        h = 0
+        while h < len(self._values):
+            v, w = self._values[h], self._weights[h]
+            if len(v) > self._capacity(h):
+                order = np.argsort(v, kind='mergesort')
+                v, w = v[order], w[order]
+                #an odd item stays on this level
+                rest = len(v) % 2
+                a, b = v[rest::2], v[rest+1::2]
+                wa, wb = w[rest::2], w[rest+1::2]
+                total = wa + wb
+                keep_a = self._rng.random_sample(len(a)) * total < wa
+                self._values[h], self._weights[h] = v[:rest], w[:rest]
+                self._add(h + 1, np.where(keep_a, a, b), total)
+            h += 1
+
+    def update(self, values, weights=None):
+        """Add values to the sketch.
+
+        Parameters
+        ----------
+        values : array-like of shape = (n_samples)
+            New values.
+
+        weights : array-like of shape = (n_samples), optional
+            Positive weights of the values, 1 by default.
+        """
+        values = np.asarray(values, dtype=float).ravel()
+        if weights is None:
+            weights = np.ones(len(values))
+        weights = np.asarray(weights, dtype=float).ravel()
+        if len(weights) != len(values):
+            raise ValueError("values and weights must have the same length")
+        self._add(0, values, weights / self._scale)
+        self._compress()
+
+    def merge(self, other):
+        """Add the values of another sketch to this one."""
+        ratio = other._scale / self._scale
+        for h in range(len(other._values)):
+            self._add(h, other._values[h], other._weights[h] * ratio)
+        self._compress()
+
+    def decay(self, factor):
+        """Multiply the weights of all values seen so far by factor, in (0, 1]."""
+        if not 0 < factor <= 1:
+            raise ValueError("the decay factor must be in (0, 1]")
+        self._scale *= factor
+        if self._scale < _MIN_SCALE:
+            self._weights = [w * self._scale for w in self._weights]
+            self._scale = 1.
+
+    @property
+    def total_weight(self):
+        """Total weight of the values seen so far."""
+        return sum(w.sum() for w in self._weights) * self._scale
+
+    def items(self):
+        """Return the sorted stored values and their weights."""
+        if not self._values:
+            return np.zeros(0), np.zeros(0)
+        v = np.concatenate(self._values)
+        w = np.concatenate(self._weights) * self._scale
+        order = np.argsort(v, kind='mergesort')
+        return v[order], w[order]
+
+    def rank(self, x):
+        """Estimated fraction of the weight below x, counting ties as half."""
+        v, w = self.items()
+        total = w.sum()
+        if total == 0:
+            return np.nan
+        less, equal = _pair_weights((v, w), (np.atleast_1d(x), np.ones(1)))
+        return (less + 0.5 * equal) / total
+
+    def quantile(self, q):
+        """Estimated value at the fraction q of the weight."""
+        v, w = self.items()
+        if len(v) == 0:
+            return np.nan
+        cum = np.cumsum(w)
+        return v[min(np.searchsorted(cum, q * cum[-1]), len(v) - 1)]
+
+
+def _pair_weights(a, b):
+    """Summed weights of the pairs of sorted items of a and b with a < b, and a == b."""
+    va, wa = a
+    vb, wb = b
+    cum = np.concatenate(([0.], np.cumsum(wa)))
+    lo = np.searchsorted(va, vb, side='left')
+    hi = np.searchsorted(va, vb, side='right')
+    return wb.dot(cum[lo]), wb.dot(cum[hi] - cum[lo])
+
+
+class StreamingAuditor(object):
+    """Running estimates of the rank parity, equality and calibration errors.
+
+    The predicted values of every group, and of every distinct y_true value
+    when y_true is given, are summarized by a QuantileSketch. The metrics are
+    computed from the weighted pairs between the sketches, so with graded
+    y_true values (at most max_levels distinct values) no item needs to be
+    stored, and memory and query time do not grow with the stream. As in
+    fare.metrics, items are ranked by increasing predicted value, pairs tied
+    on the predicted value count as half for rank parity and are never
+    inverted for rank equality and calibration.
+
+    Parameters
+    ----------
+    k : int, optional
+        Capacity of the sketches, see QuantileSketch. With the default, the
+        errors are typically within 0.01 of their exact values.
+
+    seed : int, optional
+        Seed of the sketches.
+
+    max_levels : int, optional
+        Maximum number of distinct y_true values. Updates with more values
+        raise a ValueError; bin continuous y_true values into grades first.
+
+    Examples
+    --------
+    >>> auditor = StreamingAuditor(seed=0)
+    >>> for y_pred, groups in feed:
+    ...     auditor.update(y_pred, groups)
+    >>> auditor.rank_parity()
+    """
+
+    def __init__(self, k=200, seed=None, max_levels=_GRADED_MAX_LEVELS):
+        self.k = k
+        self.max_levels = max_levels
+        self._rng = np.random.RandomState(seed)
+        #sketches keyed by (group, y_true value), the value is None without y_true
+        self._sketches = {}
+        self._labeled = None
+        #sums of the weights and squared weights of each group
+        self._weight = np.zeros(2)
+        self._square = np.zeros(2)
+
+    def _sketch(self, key):
+        sketch = self._sketches.get(key)
+        if sketch is None:
+            sketch = self._sketches[key] = QuantileSketch(self.k, self._rng.randint(2**31))
+        return sketch
+
+    def _check_labeled(self, labeled):
+        if self._labeled is None:
+            self._labeled = labeled
+        elif self._labeled != labeled:
+            raise ValueError("y_true must be given with either all or none of the updates")
+
+    def _check_levels(self, levels):
+        known = set(key[1] for key in self._sketches)
+        if len(known.union(levels)) > self.max_levels:
+            raise ValueError("y_true has more than max_levels=%d distinct values, bin it into grades"
+                             % self.max_levels)
+
+    def update(self, y_pred, groups, y_true=None, weights=None):
+        """Add items to the stream.
+
+        Parameters
+        ----------
+        y_pred : array-like of shape = (n_samples)
+            Estimated target values of the new items.
+
+        groups : array-like of shape = (n_samples)
+            Binary integer array with group labels for each item.
+
+        y_true : array-like of shape = (n_samples), optional
+            Ground truth target values, required for rank equality and
+            calibration.
+
+        weights : array-like of shape = (n_samples), optional
+            Positive weights of the items, 1 by default.
+        """
+        y_pred = np.asarray(y_pred, dtype=float).ravel()
+        groups = np.asarray(groups).ravel()
+        if len(groups) != len(y_pred):
+            raise ValueError("y_pred and groups must have the same length")
+        if not np.isin(groups, [0, 1]).all():
+            raise ValueError("groups must hold binary labels")
+        groups = groups.astype(int)
+        weights = np.ones(len(y_pred)) if weights is None else np.asarray(weights, dtype=float).ravel()
+        self._check_labeled(y_true is not None)
+        if y_true is None:
+            labels, levels = np.zeros(len(y_pred), dtype=int), [None]
+        else:
+            levels, labels = np.unique(np.asarray(y_true).ravel(), return_inverse=True)
+            if len(labels) != len(y_pred):
+                raise ValueError("y_true and y_pred must have the same length")
+            self._check_levels(level.item() for level in levels)
+        self._weight += np.bincount(groups, weights=weights, minlength=2)
+        self._square += np.bincount(groups, weights=weights ** 2, minlength=2)
+        for g in range(2):
+            for i, level in enumerate(levels):
+                mask = (groups == g) & (labels == i)
+                if mask.any():
+                    key = (g, level if level is None else level.item())
+                    self._sketch(key).update(y_pred[mask], weights[mask])
+
+    def merge(self, other):
+        """Add the items of another StreamingAuditor, e.g. from another worker."""
+        if other._labeled is not None:
+            self._check_labeled(other._labeled)
+        if self._labeled:
+            self._check_levels(key[1] for key in other._sketches)
+        for key, sketch in other._sketches.items():
+            self._sketch(key).merge(sketch)
+        self._weight += other._weight
+        self._square += other._square
+
+    def decay(self, factor):
+        """Multiply the weights of all items seen so far by factor, in (0, 1].
+
+        Calling decay at regular intervals, e.g. decay(0.5) every hour, gives
+        the estimates a half-life.
+        """
+        for sketch in self._sketches.values():
+            sketch.decay(factor)
+        self._weight *= factor
+        self._square *= factor ** 2
+
+    def _items(self, group):
+        """Sorted sketch items of every y_true value of a group, by y_true value."""
+        keys = sorted(key for key in self._sketches if key[0] == group)
+        return [self._sketches[key].items() for key in keys], [key[1] for key in keys]
+
+    def _merged(self, group):
+        items, _ = self._items(group)
+        if not items:
+            return np.zeros(0), np.zeros(0)
+        v = np.concatenate([i[0] for i in items])
+        w = np.concatenate([i[1] for i in items])
+        order = np.argsort(v, kind='mergesort')
+        return v[order], w[order]
+
+    def rank_parity(self):
+        """Estimated rank parity errors, see fare.metrics.rank_parity."""
+        n0, n1 = self._weight
+        if n1 == 0:
+            return 1., 0.
+        if n0 == 0:
+            return 0., 1.
+        less, equal = _pair_weights(self._merged(0), self._merged(1))
+        p = n0 * n1
+        #pairs with the group 0 item placed first
+        p01 = less + 0.5 * equal
+        return p01 / p, (p - p01) / p
+
+    def _inversion_matrix(self):
+        """Estimated weights of the inverted pairs, as in fare.metrics._inversion_matrix."""
+        if not self._labeled:
+            raise ValueError("rank equality and calibration require y_true in the updates")
+        c = np.zeros((2, 2))
+        items = [self._items(g) for g in range(2)]
+        for x in range(2):
+            for y in range(2):
+                #a later item of group x below an earlier item of group y
+                for later, a in zip(*items[x]):
+                    for earlier, b in zip(*items[y]):
+                        if b > a:
+                            c[x, y] += _pair_weights(earlier, later)[0]
+        return c
+
+    def rank_equality(self):
+        """Estimated rank equality errors, see fare.metrics.rank_equality."""
+        p = self._weight[0] * self._weight[1]
+        if p == 0:
+            return 0., 0.
+        c = self._inversion_matrix()
+        return c[0, 1] / p, c[1, 0] / p
+
+    def rank_calibration(self):
+        """Estimated rank calibration errors, see fare.metrics.rank_calibration."""
+        #summed weights of the pairs of items involving each group
+        pairs = (self._weight ** 2 - self._square) / 2.
+        total = (self._weight.sum() ** 2 - self._square.sum()) / 2.
+        p0, p1 = total - pairs[1], total - pairs[0]
+        c = self._inversion_matrix() if (p0 > 0 or p1 > 0) else np.zeros((2, 2))
+        mixed = c[0, 1] + c[1, 0]
+        e0 = 0. if p0 <= 0 else (mixed + c[0, 0]) / p0
+        e1 = 0. if p1 <= 0 else (mixed + c[1, 1]) / p1
+        return e0, e1
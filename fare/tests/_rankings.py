@@ -0,0 +1,13 @@
+"""Random rankings shared by the tests"""
+
+
+import numpy as np
+
+
+def random_ranking(n, seed=0):
+    """ A ranking of n items whose predictions are noisy true values, with random groups """
+    rng = np.random.RandomState(seed)
+    y_true = rng.permutation(n).astype(float)
+    y_pred = y_true + rng.normal(0, n / 4., n)
+    groups = rng.randint(0, 2, n)
+    return y_true, y_pred, groups
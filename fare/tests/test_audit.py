@@ -2,6 +2,7 @@
 
 
 import pytest
+import numpy as np
 
 #from sklearn import datasets
 
@@ -11,9 +12,302 @@ from fare.audit import audit_parity
 from fare.audit import audit_equality
 from fare.audit import audit_calibration
 from fare.audit import generate_diagnostics
+from fare.audit import generate_diagnostics_batch
+from fare.audit import audit_multiresolution
+from fare.audit import worst_segment
+from fare.audit import audit_budgeted
+from fare.audit import plot_audit
+from fare.audit import plot_audits
+from fare.audit import _window_starts
+from fare.audit import _van_der_corput_order
+from fare.audit import _segment_counter
+from fare.audit import _calibration_gap_bound
+from fare.metrics import _presort
+
+from fare.instrument import profile
+
+from fare.metrics import rank_parity
+from fare.metrics import rank_equality
+from fare.metrics import rank_calibration
+from fare.tests._rankings import random_ranking
 
 
 @pytest.mark.audit_parity
 def test_audit_parity():
     assert True
 
+
+
+def _naive_audit(metric, cols, window, step):
+    """
+    Helper function reproducing the per-window slicing audit loop.
+    """
+    r = np.transpose(cols)
+    r = r[r[:,-2].argsort()] if len(cols) == 3 else r[r[:,0].argsort()]
+    err0, err1 = [], []
+    start, end = 0, window
+    while end < len(r):
+        e0, e1 = metric(*r[start:end].T)
+        err0.append(e0)
+        err1.append(e1)
+        start += step
+        end += step
+    if start > len(r) - window:
+        e0, e1 = metric(*r[len(r)-window:].T)
+        err0.append(e0)
+        err1.append(e1)
+    return err0, err1
+
+
+@pytest.mark.parametrize("n,window,step", [(60, 10, 3), (60, 10, 10), (50, 10, 5), (600, 300, 100)])
+def test_audits_match_per_window_metrics(n, window, step):
+    y_true, y_pred, groups = random_ranking(n)
+
+    expected = _naive_audit(rank_parity, [y_pred, groups], window, step)
+    assert np.allclose(audit_parity(y_pred, groups, window, step), expected)
+
+    expected = _naive_audit(rank_equality, [y_true, y_pred, groups], window, step)
+    assert np.allclose(audit_equality(y_true, y_pred, groups, window, step), expected)
+
+    expected = _naive_audit(rank_calibration, [y_true, y_pred, groups], window, step)
+    assert np.allclose(audit_calibration(y_true, y_pred, groups, window, step), expected)
+
+
+def test_window_starts():
+    assert list(_window_starts(10, 4, 3)) == [0, 3]
+    assert list(_window_starts(10, 4, 4)) == [0, 4, 6]
+    with pytest.raises(ValueError):
+        _window_starts(3, 4, 1)
+
+
+@pytest.mark.parametrize("bins", [[0, 10, 50, 200], [0, 5, 5, 300, 400], "quantile:4"])
+def test_audits_bins_match_per_bin_metrics(bins):
+    y_true, y_pred, groups = random_ranking(400, seed=1)
+    order = np.argsort(y_pred)
+    if isinstance(bins, str):
+        edges = np.searchsorted(y_pred[order], np.quantile(y_pred, [.25, .5, .75]))
+        edges = [0] + list(edges) + [400]
+    else:
+        edges = bins
+    for metric, audit, cols in [
+            (rank_parity, audit_parity, [y_pred, groups]),
+            (rank_equality, audit_equality, [y_true, y_pred, groups]),
+            (rank_calibration, audit_calibration, [y_true, y_pred, groups])]:
+        expected = np.array([metric(*[np.asarray(c)[order][s:e] for c in cols])
+                             for s, e in zip(edges[:-1], edges[1:])])
+        err0, err1 = audit(*cols, bins=bins)
+        assert np.allclose(err0, expected[:, 0])
+        assert np.allclose(err1, expected[:, 1])
+
+
+def test_audit_requires_window_or_bins():
+    with pytest.raises(ValueError):
+        audit_parity([1, 2, 3], [0, 1, 0])
+    with pytest.raises(ValueError):
+        audit_parity([1, 2, 3], [0, 1, 0], bins="deciles")
+
+
+@pytest.mark.parametrize("n", [600, 613])
+def test_audit_multiresolution_matches_audits(n):
+    y_true, y_pred, groups = random_ranking(n, seed=2)
+    windows, steps = [20, 40, 100, 300], [10, 20, 50, 60]
+    for metric, audit, cols in [
+            ("parity", audit_parity, [y_pred, groups]),
+            ("equality", audit_equality, [y_true, y_pred, groups]),
+            ("calibration", audit_calibration, [y_true, y_pred, groups])]:
+        errors = audit_multiresolution(y_true, y_pred, groups, windows, steps, metric)
+        assert sorted(errors) == windows
+        for window, step in zip(windows, steps):
+            assert np.allclose(errors[window], audit(*cols, window, step))
+
+
+@pytest.mark.parametrize("metric", ["equality", "calibration"])
+def test_audit_multiresolution_coprime_windows(metric):
+    """ Window sizes without a common block fall back to per-size audits """
+    y_true, y_pred, groups = random_ranking(3000, seed=3)
+    audit = audit_equality if metric == "equality" else audit_calibration
+    windows, steps = [50, 301], [25, 150]
+    with profile() as p:
+        errors = audit_multiresolution(y_true, y_pred, groups, windows, steps, metric)
+    #one count per window, no pass per block of the largest window
+    n_windows = sum(len(_window_starts(3000, w, s)) for w, s in zip(windows, steps))
+    assert p.as_dict()["phases"]["merge"]["calls"] == n_windows
+    for window, step in zip(windows, steps):
+        assert np.allclose(errors[window], audit(y_true, y_pred, groups, window, step))
+
+
+@pytest.mark.parametrize("metric", ["parity", "equality", "calibration"])
+def test_audit_budgeted(metric):
+    rng = np.random.RandomState(0)
+    y_true = rng.permutation(500)
+    y_pred = y_true + rng.normal(0, 100, 500)
+    groups = rng.randint(0, 2, 500)
+    audit = {'parity': lambda: audit_parity(y_pred, groups, 50, 20),
+             'equality': lambda: audit_equality(y_true, y_pred, groups, 50, 20),
+             'calibration': lambda: audit_calibration(y_true, y_pred, groups, 50, 20)}[metric]
+    err0, err1 = audit()
+    starts, e0, e1 = audit_budgeted(y_true, y_pred, groups, 50, 20, metric)
+    assert np.array_equal(starts, _window_starts(500, 50, 20))
+    assert np.allclose(e0, err0) and np.allclose(e1, err1)
+    #an early stop in coarse to fine order covers the whole ranking
+    starts, e0, e1 = audit_budgeted(y_true, y_pred, groups, 50, 20, metric, max_windows=5,
+                                    order='coarse_to_fine')
+    idx = np.searchsorted(_window_starts(500, 50, 20), starts)
+    assert len(starts) == 5 and starts[0] == 0 and starts[-1] > 300
+    assert np.allclose(e0, np.asarray(err0)[idx]) and np.allclose(e1, np.asarray(err1)[idx])
+
+
+def test_audit_budgeted_cancel():
+    import threading
+    cancel = threading.Event()
+    calls = []
+    def progress(done, total):
+        calls.append((done, total))
+        if done == 3:
+            cancel.set()
+    starts, e0, e1 = audit_budgeted(None, np.arange(100), np.arange(100) % 2, 10, 10, 'parity',
+                                    progress=progress, cancel=cancel)
+    assert list(starts) == [0, 10, 20]
+    assert calls == [(1, 9), (2, 9), (3, 9)]
+    starts, e0, e1 = audit_budgeted(None, np.arange(100), np.arange(100) % 2, 10, 10, 'parity',
+                                    time_budget=0)
+    assert len(starts) == 0 and e0 == [] and e1 == []
+
+
+def test_van_der_corput_order():
+    for k in [0, 1, 2, 7, 64, 100]:
+        assert sorted(_van_der_corput_order(k)) == list(range(k))
+    assert list(_van_der_corput_order(8)) == [0, 4, 2, 6, 1, 5, 3, 7]
+
+
+@pytest.mark.parametrize("metric", ["parity", "equality", "calibration"])
+def test_worst_segment_matches_brute_force(metric):
+    rank = {"parity": lambda yt, yp, g: rank_parity(yp, g),
+            "equality": rank_equality, "calibration": rank_calibration}[metric]
+    for seed in range(5):
+        y_true, y_pred, groups = random_ranking(40, seed=seed)
+        order = np.argsort(y_pred)
+        yt, yp, g = y_true[order], y_pred[order], groups[order]
+        best = 0
+        for s in range(40):
+            for e in range(s + 5, min(s + 30, 40) + 1):
+                if 0 < g[s:e].sum() < e - s:
+                    e0, e1 = rank(yt[s:e], yp[s:e], g[s:e])
+                    best = max(best, abs(e0 - e1))
+        start, end, e0, e1 = worst_segment(y_true, y_pred, groups, 5, metric, max_length=30)
+        assert 5 <= end - start <= 30
+        assert np.isclose(abs(e0 - e1), best)
+        assert np.allclose((e0, e1), rank(yt[start:end], yp[start:end], g[start:end]))
+
+
+@pytest.mark.parametrize("metric,n,fraction", [("parity", 100000, 0.01), ("equality", 5000, 0.15),
+                                                ("calibration", 3000, 0.6)])
+def test_worst_segment_pruning(metric, n, fraction):
+    """ The bounds prune most segments, calibration is only guarded against regressions """
+    y_true, y_pred, groups = random_ranking(n)
+    with profile() as p:
+        worst_segment(y_true, y_pred, groups, 200, metric)
+    total = (n - 200 + 1) * (n - 200 + 2) / 2.
+    assert p.as_dict()["counters"]["segments"] < fraction * total
+
+
+def test_calibration_gap_bound():
+    """ The bound holds for every segment of a block """
+    n = 80
+    y_true, y_pred, groups = random_ranking(n, seed=5)
+    t, g, m = _presort(y_true, y_pred, groups)
+    _, _, _, parts = _segment_counter("calibration", t, g, m)
+    errors = {}
+    for s in range(n):
+        for e in range(s + 2, n + 1):
+            if g[s:e].min() != g[s:e].max():
+                errors[s, e] = rank_calibration(t[s:e], np.arange(e - s), g[s:e])
+    rng = np.random.RandomState(0)
+    for _ in range(200):
+        s_lo, s_hi = np.sort(rng.randint(0, n // 2, 2))
+        e_lo, e_hi = np.sort(rng.randint(n // 2, n + 1, 2))
+        inner, outer = parts(s_hi, e_lo), parts(s_lo, e_hi)
+        block = [errors[s, e] for s in range(s_lo, s_hi + 1) for e in range(e_lo, e_hi + 1) if (s, e) in errors]
+        for x in range(2):
+            bound = _calibration_gap_bound(inner, outer, x)
+            assert all(bound >= err[x] - err[1 - x] - 1e-12 for err in block)
+
+
+def test_worst_segment_single_group():
+    with pytest.raises(ValueError):
+        worst_segment(None, [1, 2, 3, 4], [0, 0, 0, 0], 2)
+    with pytest.raises(ValueError, match="min_length"):
+        worst_segment(None, [1, 2, 3, 4], [0, 1, 0, 1], 0)
+
+
+@pytest.mark.filterwarnings("error::RuntimeWarning")
+@pytest.mark.parametrize("metric", ["parity", "equality", "calibration"])
+def test_worst_segment_no_warnings(metric):
+    y_true, y_pred, groups = random_ranking(600, seed=4)
+    worst_segment(y_true, y_pred, groups, 20, metric, max_length=150)
+
+
+def test_generate_diagnostics_batch():
+    rng = np.random.RandomState(0)
+    lengths = [2, 5, 17, 30]
+    err0 = [rng.rand(k) for k in lengths]
+    err1 = [rng.rand(k) for k in lengths]
+    expected = np.array([generate_diagnostics(e0, e1) for e0, e1 in zip(err0, err1)])
+    assert np.allclose(np.transpose(generate_diagnostics_batch(err0, err1)), expected)
+
+    #the valid entries of a masked row need not be a prefix
+    mask = rng.rand(4, 30) < .7
+    e0, e1 = rng.rand(4, 30), rng.rand(4, 30)
+    expected = np.array([generate_diagnostics(a[m], b[m]) for a, b, m in zip(e0, e1, mask)])
+    assert np.allclose(np.transpose(generate_diagnostics_batch(e0, e1, mask)), expected)
+
+    with pytest.raises(ValueError):
+        generate_diagnostics_batch([[0, 1]], [[0, 1, 1]])
+
+
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_plot_audits(tmp_path, n_jobs):
+    import matplotlib.pyplot as plt
+    figures = plt.get_fignums()
+    errors = []
+    for seed in range(3):
+        y_true, y_pred, groups = random_ranking(100, seed=seed)
+        errors.append({"parity": audit_parity(y_pred, groups, 20, 10),
+                       "calibration": audit_calibration(y_true, y_pred, groups, 20, 10),
+                       "equality": audit_equality(y_true, y_pred, groups, 20, 10)})
+    filenames = [str(tmp_path / ("audit%d.png" % i)) for i in range(3)]
+    plot_audits(errors, filenames, titles=["a", "b", "c"], n_jobs=n_jobs)
+    for filename in filenames:
+        assert (tmp_path / filename).stat().st_size > 0
+    #no figures are left open
+    assert plt.get_fignums() == figures
+    with pytest.raises(ValueError):
+        plot_audits(errors, filenames[:2])
+
+
+def test_plot_audit(tmp_path):
+    import matplotlib.pyplot as plt
+    figures = plt.get_fignums()
+    y_true, y_pred, groups = random_ranking(100)
+    plot_audit(y_true, y_pred, groups, 20, 10, "audit", str(tmp_path / "audit.png"), label=False)
+    assert (tmp_path / "audit.png").stat().st_size > 0
+    #the figure is closed
+    assert plt.get_fignums() == figures
+
+
+@pytest.mark.parametrize("label", [True, False])
+def test_plot_audits_match_plot_audit(tmp_path, label):
+    """ Every plot of a batch is drawn like a single plot, on the same scale """
+    import matplotlib.image as mpimg
+    errors = []
+    for seed, n in enumerate([100, 150, 80]):
+        y_true, y_pred, groups = random_ranking(n, seed=seed)
+        errors.append({"parity": audit_parity(y_pred, groups, 20, 10),
+                       "calibration": audit_calibration(y_true, y_pred, groups, 20, 10),
+                       "equality": audit_equality(y_true, y_pred, groups, 20, 10)})
+        plot_audit(y_true, y_pred, groups, 20, 10, "t%d" % seed, str(tmp_path / ("single%d.png" % seed)),
+                   label=label)
+    filenames = [str(tmp_path / ("batch%d.png" % i)) for i in range(3)]
+    plot_audits(errors, filenames, titles=["t0", "t1", "t2"], label=label)
+    for i, filename in enumerate(filenames):
+        assert np.array_equal(mpimg.imread(filename), mpimg.imread(str(tmp_path / ("single%d.png" % i))))
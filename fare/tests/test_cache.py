@@ -0,0 +1,83 @@
+"""Testing for cache module"""
+
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+import numpy as np
+
+from fare.audit import audit_parity
+from fare.audit import audit_equality
+from fare.audit import generate_diagnostics
+from fare.cache import AuditCache
+from fare.cache import fingerprint
+from fare.tests._rankings import random_ranking
+
+
+def test_fingerprint():
+    y, g = np.arange(10), np.arange(10) % 2
+    assert fingerprint(y, g, window=2) == fingerprint(list(y), list(g), window=np.int64(2))
+    assert fingerprint(y, g, window=2) != fingerprint(y, g, window=3)
+    assert fingerprint(y, g) != fingerprint(g, y)
+    assert fingerprint(y, g, bins=[0, 5, 10]) != fingerprint(y, g, bins=[0, 4, 10])
+    assert fingerprint(y.astype(float), g) != fingerprint(y, g)
+
+
+def test_cache_hits(tmp_path):
+    cache = AuditCache(str(tmp_path))
+    y_true, y_pred, groups = random_ranking(200)
+    expected = audit_equality(y_true, y_pred, groups, 20, 10)
+    assert np.allclose(cache.audit_equality(y_true, y_pred, groups, 20, 10), expected)
+    assert len(os.listdir(str(tmp_path))) == 1
+    assert np.allclose(cache.audit_equality(y_true, y_pred, groups, 20, 10), expected)
+    assert len(os.listdir(str(tmp_path))) == 1
+    assert np.allclose(cache.audit_parity(y_pred, groups, 20, 10), audit_parity(y_pred, groups, 20, 10))
+    assert len(os.listdir(str(tmp_path))) == 2
+    err0, err1 = expected
+    for _ in range(2):
+        assert np.allclose(cache.generate_diagnostics(err0, err1), generate_diagnostics(err0, err1))
+    cache.clear()
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_cache_result_types(tmp_path):
+    """ Misses and hits return the same types, also for windows with one group """
+    cache = AuditCache(str(tmp_path))
+    y_true, y_pred = np.arange(8.), np.arange(8.)
+    groups = [0, 0, 0, 0, 1, 0, 1, 1]
+    miss = cache.audit_equality(y_true, y_pred, groups, 2, 2)
+    hit = cache.audit_equality(y_true, y_pred, groups, 2, 2)
+    assert miss == hit
+    for seq in miss + hit:
+        assert type(seq) is list
+        assert all(type(e) is np.float64 for e in seq)
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = AuditCache(str(tmp_path))
+    cache.put("a", [np.zeros(1000)])
+    os.utime(str(tmp_path / "a.npz"), (1, 1))
+    cache.put("b", [np.zeros(1000)])
+    os.utime(str(tmp_path / "b.npz"), (2, 2))
+    #reading a makes b the least recently used
+    assert cache.get("a") is not None
+    cache.max_bytes = os.path.getsize(str(tmp_path / "a.npz")) * 2
+    cache.put("c", [np.zeros(1000)])
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+
+
+def _audit_in_worker(directory):
+    y_true, y_pred, groups = random_ranking(300)
+    return AuditCache(directory).audit_equality(y_true, y_pred, groups, 30, 10)
+
+
+def test_cache_shared_by_processes(tmp_path):
+    with ProcessPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(_audit_in_worker, [str(tmp_path)] * 8))
+    for result in results:
+        assert np.allclose(result, results[0])
+    #one complete entry, no temporary files left behind
+    assert os.listdir(str(tmp_path)) == [os.listdir(str(tmp_path))[0]]
+    assert not os.listdir(str(tmp_path))[0].startswith(".tmp")
@@ -0,0 +1,100 @@
+"""Testing for cli module"""
+
+
+import json
+
+import pytest
+import numpy as np
+
+from fare.audit import audit_parity
+from fare.audit import audit_equality
+from fare.audit import audit_calibration
+from fare.audit import generate_diagnostics
+from fare.metrics import rank_parity
+from fare.metrics import rank_equality
+from fare.metrics import rank_calibration
+from fare.cli import main
+from fare.cli import read_ranking
+
+
+def _write_csv(path, n=300, seed=0):
+    rng = np.random.RandomState(seed)
+    y_true = rng.permutation(n).astype(float)
+    y_pred = y_true + rng.normal(0, n / 4., n)
+    g = rng.randint(0, 2, n)
+    h = rng.randint(0, 2, n)
+    with open(path, "w") as f:
+        f.write("id,score,truth,gender,age\n")
+        for i in range(n):
+            f.write("%d,%.17g,%.17g,%d,%s\n" % (i, y_pred[i], y_true[i], g[i], "true" if h[i] else "false"))
+    return y_true, y_pred, g, h
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_fare_audit(tmp_path, jobs):
+    y_true, y_pred, g, h = _write_csv(str(tmp_path / "ranking.csv"))
+    out = str(tmp_path / "out.json")
+    assert main([str(tmp_path / "ranking.csv"), "--y-pred", "score", "--y-true", "truth",
+                 "--group", "gender", "--group", "age", "--window", "50", "--step", "25",
+                 "--jobs", str(jobs), "-o", out]) == 0
+    with open(out) as f:
+        results = json.load(f)
+    assert results["n_samples"] == 300
+    for column, groups in [("gender", g), ("age", h)]:
+        for metric, rank, audit, cols in [
+                ("parity", rank_parity, audit_parity, [y_pred, groups]),
+                ("equality", rank_equality, audit_equality, [y_true, y_pred, groups]),
+                ("calibration", rank_calibration, audit_calibration, [y_true, y_pred, groups])]:
+            res = results["groups"][column][metric]
+            assert np.allclose([res["error0"], res["error1"]], rank(*cols))
+            err0, err1 = audit(*cols, 50, 25)
+            assert np.allclose(res["audit"]["error0"], err0)
+            assert np.allclose(res["audit"]["error1"], err1)
+            diagnostics = res["diagnostics"]
+            assert np.allclose([diagnostics["trend0"], diagnostics["trend1"], diagnostics["distance"]],
+                               generate_diagnostics(err0, err1))
+
+
+def test_fare_audit_errors(tmp_path, capsys):
+    path = str(tmp_path / "ranking.csv")
+    _write_csv(path)
+    #parity only without ground truth
+    assert main([path, "--y-pred", "score", "--group", "gender", "--window", "50", "--step", "25"]) == 0
+    assert list(json.loads(capsys.readouterr().out)["groups"]["gender"]) == ["parity"]
+    assert main([path, "--y-pred", "score", "--group", "gender", "--window", "50", "--step", "25",
+                 "--metric", "equality"]) == 1
+    assert main([path, "--y-pred", "score", "--group", "sex", "--window", "50", "--step", "25"]) == 1
+    assert main([path, "--y-pred", "score", "--group", "gender", "--window", "50", "--step", "25",
+                 "--max-memory", "0.001"]) == 1
+    assert "memory limit" in capsys.readouterr().err
+    with pytest.raises(ValueError):
+        read_ranking(path, "score", ["id"])
+    #a short row is reported with its line number
+    with open(path, "a") as f:
+        f.write("300,0.5\n")
+    assert main([path, "--y-pred", "score", "--group", "gender", "--window", "50", "--step", "25"]) == 1
+    assert "line 302" in capsys.readouterr().err
+
+
+def test_fare_audit_single_window(tmp_path, capsys):
+    path = str(tmp_path / "ranking.csv")
+    _write_csv(path, n=50)
+    #the trends of a single window are undefined, written as null
+    assert main([path, "--y-pred", "score", "--group", "gender", "--window", "50", "--step", "25"]) == 0
+    out = capsys.readouterr().out
+    assert "NaN" not in out
+    diagnostics = json.loads(out)["groups"]["gender"]["parity"]["diagnostics"]
+    assert diagnostics["trend0"] is None and diagnostics["trend1"] is None
+
+
+def test_fare_audit_parquet(tmp_path):
+    pa = pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+    rng = np.random.RandomState(0)
+    y_pred, g = rng.rand(200), rng.randint(0, 2, 200).astype(bool)
+    pq.write_table(pa.table({"score": y_pred, "group": g}), str(tmp_path / "ranking.parquet"))
+    out = str(tmp_path / "out.parquet")
+    assert main([str(tmp_path / "ranking.parquet"), "--y-pred", "score", "--group", "group",
+                 "--window", "50", "--step", "25", "-o", out]) == 0
+    table = pq.read_table(out).to_pydict()
+    assert np.allclose(table["audit_error0"][0], audit_parity(y_pred, g, 50, 25)[0])
@@ -0,0 +1,57 @@
+"""Testing for instrument module"""
+
+
+import pytest
+import numpy as np
+
+from fare.audit import audit_parity
+from fare.audit import audit_equality
+from fare.metrics import rank_parity
+from fare.instrument import profile
+from fare.instrument import add_hook
+from fare.instrument import remove_hook
+from fare.instrument import phase
+from fare.tests._rankings import random_ranking
+
+
+def test_profile_audits():
+    y_true, y_pred, groups = random_ranking(1000)
+    with profile() as p:
+        err0, _ = audit_equality(y_true, y_pred, groups, 300, 100)
+        audit_parity(y_pred, groups, 100, 100)
+    stats = p.as_dict()
+    phases = stats["phases"]
+    assert phases["audit_equality.windows"]["calls"] == 1
+    assert phases["audit_equality.windows"]["peak_size"] == 300
+    assert phases["presort"]["peak_size"] == 1000
+    assert phases["merge"]["calls"] == len(err0)
+    assert stats["counters"]["windows"] == len(err0) + 9
+    assert stats["counters"]["pairs"] == len(err0) * 300 * 299 // 2
+    assert all(ph["time"] >= 0 for ph in phases.values())
+
+
+def test_profile_legacy_metrics_and_hooks():
+    y_true, y_pred, groups = random_ranking(50)
+    events = []
+    hook = lambda name, elapsed, size, counters: events.append((name, size, counters))
+    add_hook(hook)
+    try:
+        rank_parity(y_pred, groups)
+    finally:
+        remove_hook(hook)
+    assert events == [("count_inversions", 50, {"pairs": 50 * 49})]
+    #nothing is recorded once the hook is removed
+    rank_parity(y_pred, groups)
+    assert len(events) == 1
+
+
+def test_nested_profiles():
+    with profile() as outer:
+        with phase("a", size=3, items=2):
+            pass
+        with profile() as inner:
+            with phase("a", size=5, items=1):
+                pass
+    assert outer.as_dict() == {"phases": {"a": {"calls": 2, "time": pytest.approx(0, abs=1),
+                                                "peak_size": 5}}, "counters": {"items": 3}}
+    assert inner.as_dict()["counters"] == {"items": 1}
@@ -16,10 +16,17 @@ from fare.metrics import _merge_cal
 from fare.metrics import _merge_eq
 from fare.metrics import _merge_parity
 from fare.metrics import _count_inversions
+from fare.metrics import _above_counts
 
 from fare.metrics import rank_equality
 from fare.metrics import rank_calibration
 from fare.metrics import rank_parity
+from fare.metrics import inversion_attribution
+from fare.metrics import swap_sensitivity
+from fare.metrics import rank_parity_weighted
+from fare.metrics import rank_equality_weighted
+from fare.metrics import rank_calibration_weighted
+from fare.metrics import dcg_discount
 
 
 def _eq_np64(var, value):
@@ -133,3 +140,138 @@ def test_scenario_3():
     # Parity
     error0,error1 = rank_parity(y_pred,groups)    
     assert _eq_np64(error0, 0.5) and _eq_np64(error1, 0.5)
+
+@pytest.mark.parametrize("n", [10, 300, 1000])
+def test_above_counts(n):
+    """ Merge counting matches comparing all pairs, including ties """
+    rng = np.random.RandomState(n)
+    t = rng.randint(0, n // 3, n)
+    g = rng.randint(0, 2, n)
+    above = _above_counts(t, g, n)
+    inv = np.triu(t[:, None] > t[None, :], 1)
+    assert (above[:, 1] == inv.T.dot(g)).all()
+    assert (above[:, 0] == inv.T.dot(1 - g)).all()
+    above, below = _above_counts(t, g, n, below=True)
+    assert (above[:, 1] == inv.T.dot(g)).all()
+    assert (below[:, 1] == inv.dot(g)).all()
+    assert (below[:, 0] == inv.dot(1 - g)).all()
+
+@pytest.mark.parametrize("n", [8, 500])
+def test_inversion_attribution(n):
+    """ Attribution matches counting all cross group pairs and sums to the equality error """
+    rng = np.random.RandomState(n)
+    y_true = rng.permutation(n)
+    y_pred = y_true + rng.normal(0, n / 4., n)
+    groups = rng.randint(0, 2, n)
+    favored, disfavored = inversion_attribution(y_true, y_pred, groups)
+    #inv[i, j] is True when i is placed above j of the other group with a lower true value
+    inv = (y_pred[:, None] > y_pred[None, :]) & (y_true[:, None] < y_true[None, :])
+    inv &= groups[:, None] != groups[None, :]
+    assert (favored == inv.sum(axis=1)).all()
+    assert (disfavored == inv.sum(axis=0)).all()
+    p = np.bincount(groups, minlength=2).prod()
+    e0, e1 = rank_equality(y_true, y_pred, groups)
+    assert np.isclose(favored[groups == 0].sum() / p, e0)
+    assert np.isclose(favored[groups == 1].sum() / p, e1)
+
+@pytest.mark.parametrize("metric", ["parity", "equality", "calibration"])
+def test_swap_sensitivity(metric):
+    """ Changes match recomputing the metric after every adjacent swap """
+    rng = np.random.RandomState(0)
+    n = 40
+    #ties in y_true never change the inversions
+    y_true = rng.randint(0, 10, n)
+    y_pred = rng.permutation(n).astype(float)
+    groups = rng.randint(0, 2, n)
+    fnc = {"parity": lambda yp: rank_parity(yp, groups),
+           "equality": lambda yp: rank_equality(y_true, yp, groups),
+           "calibration": lambda yp: rank_calibration(y_true, yp, groups)}[metric]
+    delta0, delta1, order = swap_sensitivity(y_true, y_pred, groups, metric, return_order=True)
+    assert len(delta0) == len(delta1) == n - 1
+    e0, e1 = fnc(y_pred)
+    for i in range(n - 1):
+        swapped = y_pred.copy()
+        swapped[order[i]], swapped[order[i + 1]] = y_pred[order[i + 1]], y_pred[order[i]]
+        s0, s1 = fnc(swapped)
+        assert np.isclose(delta0[i], s0 - e0) and np.isclose(delta1[i], s1 - e1)
+
+def _weighted_brute_force(y_true, y_pred, groups, w, pair_weight):
+    """ Weighted errors by enumerating all pairs in y_pred order """
+    order = np.argsort(y_pred)
+    t, g, w = np.asarray(y_true)[order], np.asarray(groups)[order], w
+    n = len(t)
+    i, j = np.triu_indices(n, 1)
+    pw = w[i] if pair_weight == 'top' else w[i] * w[j]
+    inv = t[i] > t[j]
+    mixed = g[i] != g[j]
+    p = pw[mixed].sum()
+    parity = pw[(g[i] == 0) & (g[j] == 1)].sum() / p
+    eq0 = pw[inv & (g[j] == 0) & (g[i] == 1)].sum() / p
+    eq1 = pw[inv & (g[j] == 1) & (g[i] == 0)].sum() / p
+    cal0 = pw[inv & ((g[i] == 0) | (g[j] == 0))].sum() / pw[(g[i] == 0) | (g[j] == 0)].sum()
+    cal1 = pw[inv & ((g[i] == 1) | (g[j] == 1))].sum() / pw[(g[i] == 1) | (g[j] == 1)].sum()
+    return (parity, 1 - parity), (eq0, eq1), (cal0, cal1)
+
+@pytest.mark.parametrize("n,pair_weight", [(20, 'top'), (20, 'product'), (400, 'top'), (400, 'product')])
+def test_weighted_metrics(n, pair_weight):
+    """ Weighted metrics match enumerating pairs, and equal the metrics without weights """
+    rng = np.random.RandomState(n)
+    y_true = rng.permutation(n)
+    y_pred = y_true + rng.normal(0, n / 4., n)
+    groups = rng.randint(0, 2, n)
+    w = dcg_discount(np.arange(n))
+    parity, eq, cal = _weighted_brute_force(y_true, y_pred, groups, w, pair_weight)
+    assert np.allclose(rank_parity_weighted(y_pred, groups, w, pair_weight), parity)
+    assert np.allclose(rank_equality_weighted(y_true, y_pred, groups, dcg_discount, pair_weight), eq)
+    assert np.allclose(rank_calibration_weighted(y_true, y_pred, groups, w, pair_weight), cal)
+
+    assert rank_parity_weighted(y_pred, groups) == rank_parity(y_pred, groups)
+    assert rank_equality_weighted(y_true, y_pred, groups) == rank_equality(y_true, y_pred, groups)
+    assert rank_calibration_weighted(y_true, y_pred, groups) == rank_calibration(y_true, y_pred, groups)
+
+def test_weighted_metrics_check_weights():
+    with pytest.raises(ValueError):
+        rank_equality_weighted([1, 2, 3], [1, 2, 3], [0, 1, 0], [1., 2.])
+    with pytest.raises(ValueError):
+        rank_equality_weighted([1, 2, 3], [1, 2, 3], [0, 1, 0], pair_weight='sum')
+
+@pytest.mark.parametrize("levels", [2, 5, 16])
+def test_graded_metrics(levels):
+    """ Graded counting matches enumerating pairs, equal grades are never inverted """
+    rng = np.random.RandomState(levels)
+    n = 300
+    y_true = rng.randint(0, levels, n)
+    y_pred = y_true + rng.normal(0, 2, n)
+    groups = rng.randint(0, 2, n)
+    i, j = np.nonzero(y_pred[:, None] < y_pred[None, :])
+    inv = y_true[i] > y_true[j]
+    gi, gj = groups[i][inv], groups[j][inv]
+    n1 = groups.sum()
+    p = (n - n1) * n1
+    eq = ((gi == 1) & (gj == 0)).sum() / p, ((gi == 0) & (gj == 1)).sum() / p
+    cal = ((gi == 0) | (gj == 0)).sum() / (_pairs(n) - _pairs(n1)), \
+          ((gi == 1) | (gj == 1)).sum() / (_pairs(n) - _pairs(n - n1))
+    for method in ['auto', 'graded']:
+        assert np.allclose(rank_equality(y_true, y_pred, groups, method), eq)
+        assert np.allclose(rank_calibration(y_true, y_pred, groups, method), cal)
+
+def test_graded_metrics_match_merge():
+    y_true = np.random.RandomState(0).permutation(12)
+    y_pred = [1, 3, 2, 5, 4, 7, 6, 9, 8, 11, 10, 0]
+    groups = [0, 1, 0, 1, 1, 0, 0, 1, 0, 1, 0, 1]
+    for rank in [rank_equality, rank_calibration]:
+        assert rank(y_true, y_pred, groups, 'graded') == rank(y_true, y_pred, groups, 'merge')
+    with pytest.raises(ValueError):
+        rank_equality(y_true, y_pred, groups, 'fenwick')
+
+@pytest.mark.parametrize("levels", [4, 20])
+def test_metric_methods_agree_on_ties(levels):
+    """ Pairs tied on y_true are never inverted, whatever the method """
+    rng = np.random.RandomState(levels)
+    y_true = rng.randint(0, levels, 200)
+    y_pred = y_true + rng.normal(0, levels / 2., 200)
+    groups = rng.randint(0, 2, 200)
+    for metric in [rank_equality, rank_calibration]:
+        merge = metric(y_true, y_pred, groups, method='merge')
+        assert np.allclose(metric(y_true, y_pred, groups, method='graded'), merge)
+        assert np.allclose(metric(y_true, y_pred, groups), merge)
@@ -0,0 +1,74 @@
+"""Testing for service module"""
+
+
+import asyncio
+
+import pytest
+import numpy as np
+
+from fare.metrics import rank_parity
+from fare.metrics import rank_equality
+from fare.metrics import rank_calibration
+from fare.service import AsyncAuditor
+from fare.tests._rankings import random_ranking
+
+
+def test_async_auditor_matches_metrics():
+    rankings = [random_ranking(n, seed) for seed, n in enumerate([1, 2, 5, 20, 300] * 20)]
+
+    async def client(auditor):
+        requests = []
+        for y_true, y_pred, groups in rankings:
+            requests.append(auditor.rank_parity(y_pred, groups))
+            requests.append(auditor.rank_equality(y_true, y_pred, groups))
+            requests.append(auditor.rank_calibration(y_true, y_pred, groups))
+        return await asyncio.gather(*requests)
+
+    async def main():
+        async with AsyncAuditor(max_batch=64, max_delay=0.01) as auditor:
+            results = await client(auditor)
+        return results, auditor.stats
+
+    results, stats = asyncio.run(main())
+    assert stats["requests"] == 300
+    #requests were coalesced, within the batch size limit
+    assert 300 / 64 <= stats["batches"] < 300
+    for i, (y_true, y_pred, groups) in enumerate(rankings):
+        assert np.allclose(results[3 * i], rank_parity(y_pred, groups))
+        assert np.allclose(results[3 * i + 1], rank_equality(y_true, y_pred, groups))
+        assert np.allclose(results[3 * i + 2], rank_calibration(y_true, y_pred, groups))
+
+
+def test_async_auditor_errors():
+    async def main():
+        auditor = AsyncAuditor(max_delay=0.01)
+        good = auditor.rank_equality([1, 2, 3], [1, 3, 2], [0, 1, 0])
+        bad = auditor.rank_equality([1, 2, 3], [1, 3], [0, 1, 0])
+        results = await asyncio.gather(good, bad, return_exceptions=True)
+        await auditor.close()
+        return results
+
+    good, bad = asyncio.run(main())
+    assert np.allclose(good, rank_equality([1, 2, 3], [1, 3, 2], [0, 1, 0]))
+    assert isinstance(bad, ValueError)
+
+
+def test_async_auditor_request_while_closing():
+    async def main():
+        auditor = AsyncAuditor(max_delay=0.01)
+        first = asyncio.ensure_future(auditor.rank_parity([1, 2], [0, 1]))
+        await asyncio.sleep(0)
+        closing = asyncio.ensure_future(auditor.close())
+        await asyncio.sleep(0)
+        late = auditor.rank_parity([1, 2], [0, 1])
+        results = await asyncio.wait_for(asyncio.gather(first, late, return_exceptions=True), 5)
+        await closing
+        #the auditor starts again after closing
+        again = await auditor.rank_parity([1, 2], [1, 0])
+        await auditor.close()
+        return results, again
+
+    (first, late), again = asyncio.run(main())
+    assert np.allclose(first, rank_parity([1, 2], [0, 1]))
+    assert isinstance(late, RuntimeError)
+    assert np.allclose(again, rank_parity([1, 2], [1, 0]))
@@ -0,0 +1,88 @@
+"""Testing for streaming module"""
+
+
+import pytest
+import numpy as np
+
+from fare.metrics import rank_parity
+from fare.metrics import rank_equality
+from fare.metrics import rank_calibration
+from fare.streaming import QuantileSketch
+from fare.streaming import StreamingAuditor
+
+
+def _graded_ranking(n, seed=0):
+    rng = np.random.RandomState(seed)
+    y_true = rng.randint(0, 5, n)
+    groups = rng.randint(0, 2, n)
+    y_pred = y_true + rng.normal(0, 2, n) + 0.3 * groups
+    return y_true, y_pred, groups
+
+
+def test_sketch_rank_error():
+    rng = np.random.RandomState(0)
+    values = rng.normal(size=100000)
+    sketch = QuantileSketch(seed=0)
+    for chunk in np.array_split(values, 50):
+        sketch.update(chunk)
+    assert np.isclose(sketch.total_weight, len(values))
+    assert sum(len(v) for v in sketch._values) < 3 * sketch.k
+    for q in [0.01, 0.25, 0.5, 0.75, 0.99]:
+        assert abs(sketch.rank(np.quantile(values, q)) - q) < 0.02
+
+
+def test_streaming_exact_when_small():
+    y_true, y_pred, groups = [1, 3, 4, 2], [1, 2, 3, 4], [0, 1, 0, 1]
+    auditor = StreamingAuditor()
+    auditor.update(y_pred, groups, y_true)
+    assert np.allclose(auditor.rank_parity(), rank_parity(y_pred, groups))
+    assert np.allclose(auditor.rank_equality(), rank_equality(y_true, y_pred, groups))
+    assert np.allclose(auditor.rank_calibration(), rank_calibration(y_true, y_pred, groups))
+
+
+def test_streaming_merge():
+    y_true, y_pred, groups = _graded_ranking(100000)
+    workers = [StreamingAuditor(seed=i) for i in range(4)]
+    for i, chunk in enumerate(np.array_split(np.arange(len(y_true)), 40)):
+        workers[i % 4].update(y_pred[chunk], groups[chunk], y_true[chunk])
+    auditor = workers[0]
+    for w in workers[1:]:
+        auditor.merge(w)
+    assert np.allclose(auditor.rank_parity(), rank_parity(y_pred, groups), atol=0.01)
+    assert np.allclose(auditor.rank_equality(), rank_equality(y_true, y_pred, groups), atol=0.01)
+    assert np.allclose(auditor.rank_calibration(), rank_calibration(y_true, y_pred, groups), atol=0.01)
+
+
+def test_streaming_decay():
+    auditor = StreamingAuditor(seed=0)
+    #group 0 first, then group 1 first
+    auditor.update(np.arange(100), np.repeat([0, 1], 50))
+    auditor.decay(1e-6)
+    auditor.update(np.arange(100), np.repeat([1, 0], 50))
+    e0, e1 = auditor.rank_parity()
+    assert e0 < 1e-5 and e1 > 1 - 1e-5
+
+
+def test_streaming_errors():
+    auditor = StreamingAuditor()
+    auditor.update([1, 2], [0, 1])
+    with pytest.raises(ValueError):
+        auditor.rank_equality()
+    with pytest.raises(ValueError):
+        auditor.update([1, 2], [0, 1], [1, 2])
+    with pytest.raises(ValueError):
+        auditor.update([1, 2], [0, 2])
+
+
+def test_streaming_max_levels():
+    auditor = StreamingAuditor(max_levels=4)
+    auditor.update([1, 2, 3], [0, 1, 0], [0, 1, 2])
+    auditor.update([4, 5], [1, 0], [2, 3])
+    #continuous y_true would add a sketch per value
+    with pytest.raises(ValueError):
+        auditor.update([6, 7], [0, 1], [0.5, 1.5])
+    other = StreamingAuditor()
+    other.update([1, 2], [0, 1], [4, 5])
+    with pytest.raises(ValueError):
+        auditor.merge(other)
+    assert len(auditor._sketches) <= 2 * 4
@@ -16,6 +16,7 @@ LICENSE = 'new BSD'
 DOWNLOAD_URL = 'https://github.com/caitlinkuhlman/fare'
 VERSION = '0.1'
 INSTALL_REQUIRES = ['numpy', 'scipy', 'matplotlib']
+EXTRAS_REQUIRE = {'parquet': ['pyarrow']}
 CLASSIFIERS = ['Intended Audience :: Science/Research',
                'Intended Audience :: Developers',
                'License :: OSI Approved',
@@ -44,4 +45,6 @@ setup(name=DISTNAME,
       classifiers=CLASSIFIERS,
       packages=['fare'],
 	  include_package_data=True,
-      install_requires=INSTALL_REQUIRES)
+      install_requires=INSTALL_REQUIRES,
+      extras_require=EXTRAS_REQUIRE,
+      entry_points={'console_scripts': ['fare-audit = fare.cli:main']})